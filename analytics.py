@@ -0,0 +1,491 @@
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+from sqlalchemy import case, delete, func, insert, select
+
+from models import (
+    db, User, Activity, Transaction, OffsetTransaction, OffsetProgram,
+    UserTypeMonth, TypeMonth, ProgramOffsetTotal, PriceDaily,
+)
+from emission_factors import factor_registry
+from db_helpers import upsert
+
+BATCH_USERS = 500          # users per grouped query when rebuilding the emission aggregates
+CHUNK_SIZE = 100000        # rows per round trip when streaming base tables
+SNAPSHOT_REFRESH = 60.0    # seconds between incremental snapshot loads
+SNAPSHOT_OVERLAP = 10000   # ids re-read behind the high-water mark, for rows committed out of id order
+MAX_TABLE_DAYS = 20000     # widest date span priced through a dense (type x day) factor table
+
+_SUMS = ("emission_value", "amount", "activity_count")
+
+
+def _additive(model, columns):
+    return {c: (lambda ex, c=c: getattr(model, c) + getattr(ex, c)) for c in columns}
+
+
+def _next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+# --- Emissions by (user, type, month) and by (type, month) ---
+def month_rows(users, activity_types, dates, emissions, amounts, counts):
+    """Sum parallel per-row (or per-group) arrays into UserTypeMonth row dicts."""
+    if not len(users):
+        return []
+    user_ids, user_codes = np.unique(np.asarray(users, dtype=np.int64), return_inverse=True)
+    kinds, type_codes = np.unique(np.asarray(activity_types, dtype=object), return_inverse=True)
+    months = np.asarray(dates, dtype="datetime64[D]").astype("datetime64[M]")
+    first = months.min()
+    month_codes = (months - first).astype(np.int64)
+    shape = (len(user_ids), len(kinds), int(month_codes.max()) + 1)
+    groups, inverse = np.unique(np.ravel_multi_index((user_codes, type_codes, month_codes), shape),
+                                return_inverse=True)
+    sums = [np.bincount(inverse, weights=np.asarray(v, dtype=float)) for v in (emissions, amounts, counts)]
+    month_starts = (first + np.arange(shape[2])).astype("datetime64[D]").astype(object)
+    u, t, m = np.unravel_index(groups, shape)
+    return [
+        {"user_id": int(user_ids[ui]), "activity_type": kinds[ti], "month": month_starts[mi],
+         "emission_value": e, "amount": a, "activity_count": int(n)}
+        for ui, ti, mi, e, a, n in zip(u.tolist(), t.tolist(), m.tolist(), *(s.tolist() for s in sums))
+    ]
+
+
+def _add_tenant(rows, removed=()):
+    """Add UserTypeMonth-shaped `rows` to the TypeMonth totals, less the `removed` ones."""
+    totals = {}
+    for sign, group in ((1, rows), (-1, removed)):
+        for r in group:
+            total = totals.setdefault((r["activity_type"], r["month"]), [0.0, 0.0, 0])
+            total[0] += sign * r["emission_value"]
+            total[1] += sign * r["amount"]
+            total[2] += sign * r["activity_count"]
+    upsert(TypeMonth, [
+        {"activity_type": t, "month": m, "emission_value": e, "amount": a, "activity_count": n}
+        for (t, m), (e, a, n) in sorted(totals.items())
+    ], ["activity_type", "month"], update=_additive(TypeMonth, _SUMS))
+
+
+def add_activities(user_id, batch):
+    """Add a priced ActivityBatch to the emission aggregates. Caller commits."""
+    rows = month_rows(np.full(len(batch), user_id), batch.activity_types, batch.dates,
+                      batch.emissions, batch.amounts, np.ones(len(batch)))
+    upsert(UserTypeMonth, rows, ["user_id", "activity_type", "month"], update=_additive(UserTypeMonth, _SUMS))
+    _add_tenant(rows)
+
+
+def type_month_totals(user_ids, start=None, end=None, factor_index=None):
+    """UserTypeMonth rows recomputed from Activity for whole months from `start`'s through `end`'s."""
+    if factor_index is None:
+        factor_index = factor_registry.index()
+    query = db.session.query(
+        Activity.user_id, Activity.activity_type, Activity.date, func.sum(Activity.amount), func.count(Activity.id)
+    ).filter(Activity.user_id.in_(user_ids))
+    if start is not None:
+        query = query.filter(Activity.date >= start.replace(day=1))
+    if end is not None:
+        query = query.filter(Activity.date < _next_month(end))
+    groups = query.group_by(Activity.user_id, Activity.activity_type, Activity.date).all()
+    if not groups:
+        return []
+    users, types, dates, amounts, counts = zip(*groups)
+    amounts = np.array(amounts, dtype=float)
+    emissions = amounts * factor_index.factors_at(types, dates)
+    return month_rows(users, types, dates, emissions, amounts, counts)
+
+
+def refresh_emissions(user_ids, start=None, end=None, factor_index=None):
+    """Re-price the emission aggregates of `user_ids` for every month overlapping [start, end].
+
+    Called by recalc.recalculate() after factor revisions: the users' rows
+    for those months are replaced and the tenant totals adjusted by the
+    difference. Caller commits.
+    """
+    scope = [UserTypeMonth.user_id.in_(user_ids)]
+    if start is not None:
+        scope.append(UserTypeMonth.month >= start.replace(day=1))
+    if end is not None:
+        scope.append(UserTypeMonth.month <= end)
+    removed = [
+        dict(zip(("activity_type", "month") + _SUMS, row))
+        for row in db.session.query(UserTypeMonth.activity_type, UserTypeMonth.month,
+                                    *(getattr(UserTypeMonth, c) for c in _SUMS)).filter(*scope)
+    ]
+    db.session.execute(delete(UserTypeMonth).where(*scope))
+    rows = type_month_totals(user_ids, start, end, factor_index)
+    if rows:
+        db.session.execute(insert(UserTypeMonth), rows)
+    _add_tenant(rows, removed)
+
+
+# --- Offsets by program ---
+def add_offset(program_id, co2_offset, credits_used):
+    upsert(ProgramOffsetTotal, [
+        {"program_id": program_id, "co2_offset": co2_offset, "credits_used": credits_used, "offset_count": 1}
+    ], ["program_id"], update=_additive(ProgramOffsetTotal, ("co2_offset", "credits_used", "offset_count")))
+
+
+# --- Marketplace price per day ---
+def add_trades(trades, on=None):
+    """Fold (credits, amount) trades, in settlement order, into the day's price candle. Caller commits.
+
+    Every settlement already serializes on the order-book stamp, so the
+    single row per day adds no lock contention of its own.
+    """
+    trades = [(credits, amount) for credits, amount in trades if credits > 0]
+    if not trades:
+        return
+    prices = [amount / credits for credits, amount in trades]
+    upsert(PriceDaily, [{
+        "date": on or datetime.utcnow().date(),  # Transaction.created_at is UTC
+        "open": prices[0], "high": max(prices), "low": min(prices), "close": prices[-1],
+        "credits": sum(c for c, _ in trades), "value": sum(a for _, a in trades), "trade_count": len(trades),
+    }], ["date"], update={
+        "high": lambda ex: case((ex.high > PriceDaily.high, ex.high), else_=PriceDaily.high),
+        "low": lambda ex: case((ex.low < PriceDaily.low, ex.low), else_=PriceDaily.low),
+        "close": lambda ex: ex.close,
+        **_additive(PriceDaily, ("credits", "value", "trade_count")),
+    })
+
+
+# --- Rebuild / backfill ---
+def rebuild():
+    """Recompute every aggregate table from the base tables. Caller commits.
+
+    Emissions are rebuilt BATCH_USERS users per grouped query; trades are
+    streamed in id order so each day's open and close are its first and
+    last trades. Returns {table: rows written}.
+    """
+    for model in (UserTypeMonth, TypeMonth, ProgramOffsetTotal, PriceDaily):
+        db.session.execute(delete(model))
+    factor_index = factor_registry.index()
+    written = {"user_type_month": 0}
+    last_id = 0
+    while True:
+        batch = [i for (i,) in db.session.query(User.id).filter(User.id > last_id)
+                 .order_by(User.id).limit(BATCH_USERS)]
+        if not batch:
+            break
+        rows = type_month_totals(batch, factor_index=factor_index)
+        if rows:
+            db.session.execute(insert(UserTypeMonth), rows)
+            _add_tenant(rows)
+        written["user_type_month"] += len(rows)
+        last_id = batch[-1]
+
+    offsets = db.session.query(
+        OffsetTransaction.program_id, func.sum(OffsetTransaction.co2_offset),
+        func.sum(OffsetTransaction.credits_used), func.count(OffsetTransaction.id),
+    ).group_by(OffsetTransaction.program_id).all()
+    if offsets:
+        db.session.execute(insert(ProgramOffsetTotal), [
+            {"program_id": p, "co2_offset": co2, "credits_used": credits, "offset_count": n}
+            for p, co2, credits, n in offsets
+        ])
+    written["program_offset_total"] = len(offsets)
+    written["price_daily"] = _rebuild_prices()
+    return written
+
+
+def _rebuild_prices():
+    result = db.session.execute(
+        select(Transaction.created_at, Transaction.credits_transferred, Transaction.total_amount)
+        .where(Transaction.credits_transferred > 0).order_by(Transaction.id)
+        .execution_options(stream_results=True, yield_per=CHUNK_SIZE)
+    )
+    days, credits, amounts = [], [], []
+    for chunk in result.partitions():
+        created, c, a = zip(*chunk)
+        days.append(np.array(created, dtype="datetime64[D]"))
+        credits.append(np.array(c, dtype=float))
+        amounts.append(np.array(a, dtype=float))
+    if not days:
+        return 0
+    days, credits, amounts = np.concatenate(days), np.concatenate(credits), np.concatenate(amounts)
+    order = np.argsort(days, kind="stable")  # by day, id order within a day
+    days, credits, amounts = days[order], credits[order], amounts[order]
+    prices = amounts / credits
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    ends = np.r_[starts[1:], len(days)] - 1
+    columns = {
+        "open": prices[starts], "close": prices[ends],
+        "high": np.maximum.reduceat(prices, starts), "low": np.minimum.reduceat(prices, starts),
+        "credits": np.add.reduceat(credits, starts), "value": np.add.reduceat(amounts, starts),
+        "trade_count": ends - starts + 1,
+    }
+    rows = [{"date": day} for day in days[starts].astype(object)]
+    for name, values in columns.items():
+        for row, value in zip(rows, values.tolist()):
+            row[name] = value
+    db.session.execute(insert(PriceDaily), rows)
+    return len(rows)
+
+
+# --- Reports (read the aggregate tables only) ---
+def _month_scope(model, start, end):
+    scope = []
+    if start is not None:
+        scope.append(model.month >= start.replace(day=1))
+    if end is not None:
+        scope.append(model.month <= end)
+    return scope
+
+
+def top_emitters(limit=5, start=None, end=None):
+    """{activity_type: [(user_id, kg CO₂e), ...]}: each type's `limit` largest emitters."""
+    totals = (
+        select(UserTypeMonth.activity_type, UserTypeMonth.user_id,
+               func.sum(UserTypeMonth.emission_value).label("emission"))
+        .where(*_month_scope(UserTypeMonth, start, end))
+        .group_by(UserTypeMonth.activity_type, UserTypeMonth.user_id)
+        .subquery()
+    )
+    ranked = select(
+        totals,
+        func.row_number().over(partition_by=totals.c.activity_type, order_by=totals.c.emission.desc()).label("rank"),
+    ).subquery()
+    rows = db.session.execute(
+        select(ranked.c.activity_type, ranked.c.user_id, ranked.c.emission)
+        .where(ranked.c.rank <= limit)
+        .order_by(ranked.c.activity_type, ranked.c.rank)
+    )
+    leaders = {}
+    for activity_type, user_id, emission in rows:
+        leaders.setdefault(activity_type, []).append((user_id, emission))
+    return leaders
+
+
+def emissions_by_type_month(start=None, end=None):
+    """[(month, activity_type, kg CO₂e, amount, activities)] across all users, by month."""
+    return (
+        db.session.query(TypeMonth.month, TypeMonth.activity_type, TypeMonth.emission_value,
+                         TypeMonth.amount, TypeMonth.activity_count)
+        .filter(*_month_scope(TypeMonth, start, end), TypeMonth.activity_count > 0)
+        .order_by(TypeMonth.month, TypeMonth.activity_type)
+        .all()
+    )
+
+
+def price_history(start=None, end=None):
+    query = db.session.query(PriceDaily)
+    if start is not None:
+        query = query.filter(PriceDaily.date >= start)
+    if end is not None:
+        query = query.filter(PriceDaily.date <= end)
+    return query.order_by(PriceDaily.date).all()
+
+
+def offsets_by_program():
+    """[(program name, kg CO₂ offset, credits used, offsets)], largest first."""
+    return (
+        db.session.query(OffsetProgram.name, ProgramOffsetTotal.co2_offset,
+                         ProgramOffsetTotal.credits_used, ProgramOffsetTotal.offset_count)
+        .join(OffsetProgram, OffsetProgram.id == ProgramOffsetTotal.program_id)
+        .order_by(ProgramOffsetTotal.co2_offset.desc())
+        .all()
+    )
+
+
+# --- Columnar snapshot for ad-hoc group-bys ---
+class _Column:
+    """Append-only NumPy array with amortized O(1) appends."""
+
+    def __init__(self, dtype):
+        self._data = np.empty(1024, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        needed = self.size + len(values)
+        if needed > len(self._data):
+            grown = np.empty(max(needed, 2 * len(self._data)), dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:needed] = values
+        self.size = needed
+
+    @property
+    def values(self):
+        return self._data[:self.size]
+
+
+class ActivitySnapshot:
+    """Every Activity row as parallel NumPy columns, for group-bys in memory.
+
+    26 bytes a row (user int32, type code int16, day int32, amount and
+    priced emission float64), so 100M activities fit in under 3 GB per
+    process. Amounts and emissions are float64, matching the database.
+
+    `refresh()` appends rows past the id high-water mark (re-reading
+    SNAPSHOT_OVERLAP ids behind it and skipping ones already loaded) and
+    re-prices every row when the factor version changes; `group_by()`
+    refreshes at most every SNAPSHOT_REFRESH seconds.
+    """
+
+    DIMENSIONS = ("user_id", "activity_type", "year", "month", "date")
+    METRICS = ("emission", "amount", "count")
+
+    def __init__(self, refresh_seconds=SNAPSHOT_REFRESH):
+        self.refresh_seconds = refresh_seconds
+        self.users = _Column(np.int32)
+        self.types = _Column(np.int16)
+        self.days = _Column(np.int32)      # days since 1970-01-01
+        self.amounts = _Column(np.float64)
+        self.emissions = _Column(np.float64)
+        self.categories = []               # type code -> activity type
+        self._codes = {}
+        self._recent_ids = np.empty(0, dtype=np.int64)
+        self._factor_version = None
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.refresh_seconds = app.config.get("ANALYTICS_SNAPSHOT_REFRESH", SNAPSHOT_REFRESH)
+
+    def __len__(self):
+        return self.users.size
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and self._refreshed_at is not None \
+                    and time.monotonic() - self._refreshed_at < self.refresh_seconds:
+                return
+            factor_index = factor_registry.index()
+            version = factor_registry.version()
+            watermark = int(self._recent_ids.max()) - SNAPSHOT_OVERLAP if len(self._recent_ids) else 0
+            result = db.session.execute(
+                select(Activity.id, Activity.user_id, Activity.activity_type, Activity.date, Activity.amount)
+                .where(Activity.id > watermark).order_by(Activity.id)
+                .execution_options(stream_results=True, yield_per=CHUNK_SIZE)
+            )
+            for chunk in result.partitions():
+                self._append(chunk, factor_index)
+            if version != self._factor_version and len(self):
+                self.emissions.values[:] = self._price(self.types.values, self.days.values,
+                                                       self.amounts.values, factor_index)
+            self._factor_version = version
+            self._refreshed_at = time.monotonic()
+
+    def _append(self, chunk, factor_index):
+        ids, users, types, dates, amounts = (np.array(c) for c in zip(*chunk))
+        ids = ids.astype(np.int64)
+        new = ~np.isin(ids, self._recent_ids)
+        if not new.all():
+            ids, users, types, dates, amounts = (c[new] for c in (ids, users, types, dates, amounts))
+        if not len(ids):
+            return
+        kinds, inverse = np.unique(types.astype(object), return_inverse=True)
+        codes = np.array([self._code(k) for k in kinds], dtype=np.int16)[inverse]
+        days = dates.astype("datetime64[D]").astype(np.int32)
+        amounts = amounts.astype(np.float64)
+        self.users.extend(users.astype(np.int32))
+        self.types.extend(codes)
+        self.days.extend(days)
+        self.amounts.extend(amounts)
+        self.emissions.extend(self._price(codes, days, amounts, factor_index))
+        self._recent_ids = np.concatenate([self._recent_ids, ids])[-SNAPSHOT_OVERLAP:]
+
+    def _code(self, activity_type):
+        code = self._codes.get(activity_type)
+        if code is None:
+            code = self._codes[activity_type] = len(self.categories)
+            self.categories.append(activity_type)
+        return code
+
+    def _price(self, codes, days, amounts, factor_index):
+        """Price rows through a (type, day) factor table, so factors are looked up per distinct pair."""
+        if not len(days):
+            return np.empty(0, dtype=np.float64)
+        first, last = int(days.min()), int(days.max())
+        if last - first < MAX_TABLE_DAYS:
+            table_days, positions = np.arange(first, last + 1), days - first
+        else:
+            table_days, positions = np.unique(days, return_inverse=True)
+        table_dates = table_days.astype("datetime64[D]")
+        table = np.stack([
+            factor_index.factors_at(np.full(len(table_dates), t, dtype=object), table_dates)
+            for t in self.categories
+        ])
+        return amounts * table[codes, positions]
+
+    def group_by(self, by, metric="emission", user_ids=None, activity_types=None, start=None, end=None,
+                 top=None):
+        """Sum `metric` over rows grouped by the `by` dimensions.
+
+        Filters: user ids, activity types and an inclusive date range.
+        Returns [{dimension: value, ..., metric: total}] in key order, or
+        the `top` largest groups. Raises ValueError for unknown names or a
+        negative `top`.
+        """
+        unknown = [d for d in by if d not in self.DIMENSIONS] + ([metric] if metric not in self.METRICS else [])
+        if unknown:
+            raise ValueError(f"Unknown dimension or metric: {', '.join(unknown)}")
+        if top is not None and top < 0:
+            raise ValueError("top must be zero or more.")
+        self.refresh()
+        with self._lock:
+            users, types, days = self.users.values, self.types.values, self.days.values
+            values = None if metric == "count" else (self.emissions if metric == "emission" else self.amounts).values
+            categories = list(self.categories)
+        conditions = []
+        if user_ids is not None:
+            conditions.append(np.isin(users, np.asarray(list(user_ids), dtype=np.int32)))
+        if activity_types is not None:
+            wanted = [categories.index(t) for t in activity_types if t in categories]
+            conditions.append(np.isin(types, np.asarray(wanted, dtype=np.int16)))
+        if start is not None:
+            conditions.append(days >= np.datetime64(start, "D").astype(np.int32))
+        if end is not None:
+            conditions.append(days <= np.datetime64(end, "D").astype(np.int32))
+        if conditions:
+            mask = np.logical_and.reduce(conditions)
+            users, types, days = users[mask], types[mask], days[mask]
+            values = None if values is None else values[mask]
+        if not len(users):
+            return []
+
+        codes, shape, labels = [], [], []
+        for dimension in by:
+            if dimension == "user_id":
+                column, label = users.astype(np.int64), int
+            elif dimension == "activity_type":
+                column, label = types.astype(np.int64), categories.__getitem__
+            else:
+                unit = {"year": "Y", "month": "M", "date": "D"}[dimension]
+                # Bucket through a per-day lookup table; datetime64 casts of every row are slow
+                first_day = int(days.min())
+                buckets = np.arange(first_day, int(days.max()) + 1).astype("datetime64[D]")
+                column = buckets.astype(f"datetime64[{unit}]").astype(np.int64)[days - first_day]
+                label = (lambda v, unit=unit: str(np.datetime64(v, unit)))
+            low = int(column.min())
+            codes.append(column - low)
+            shape.append(int(column.max()) - low + 1)
+            labels.append((low, label))
+
+        size = int(np.prod(shape, dtype=np.float64)) if shape else 1
+        keys = np.ravel_multi_index(codes, shape) if codes else np.zeros(len(users), dtype=np.int64)
+        if size <= 4 * len(keys) + 1024:
+            counts = np.bincount(keys, minlength=size)
+            groups = np.flatnonzero(counts)
+            totals = counts[groups] if values is None else np.bincount(keys, weights=values, minlength=size)[groups]
+        else:  # sparse key space (e.g. user x date): sort instead of a dense table
+            groups, inverse = np.unique(keys, return_inverse=True)
+            totals = np.bincount(inverse) if values is None else np.bincount(inverse, weights=values)
+        if top is not None and top < len(totals):
+            largest = np.argpartition(-totals, top)[:top]
+            order = largest[np.argsort(-totals[largest], kind="stable")]
+            groups, totals = groups[order], totals[order]
+        elif top is not None:
+            order = np.argsort(-totals, kind="stable")
+            groups, totals = groups[order], totals[order]
+
+        parts = np.unravel_index(groups, shape) if codes else ()
+        rows = []
+        for i, total in enumerate(totals.tolist()):
+            row = {d: label(int(part[i]) + low) for d, part, (low, label) in zip(by, parts, labels)}
+            row[metric] = total
+            rows.append(row)
+        return rows
+
+
+snapshot = ActivitySnapshot()
@@ -0,0 +1,11 @@
+"""Synthetic-data generator and route benchmark for the Flask app.
+
+    python -m benchmark --users 200 --activities 100 --concurrency 8 --requests 50 --out results.json
+    python -m benchmark ... --baseline baseline.json          # diff against a stored run, exit 1 on regression
+    python -m benchmark ... --save-baseline baseline.json
+
+Runs against a scratch SQLite database unless --database is given; add
+--generate to fill an empty one, e.g. a Postgres database:
+
+    python -m benchmark --database postgresql+psycopg://localhost/bench --generate
+"""
@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Benchmark the Flask routes.")
+    data = parser.add_argument_group("synthetic data")
+    data.add_argument("--users", type=int, default=100)
+    data.add_argument("--activities", type=int, default=50, help="activities per user")
+    data.add_argument("--listings", type=int, default=500)
+    data.add_argument("--transactions", type=int, default=1000)
+    data.add_argument("--offsets", type=int, default=200)
+    data.add_argument("--database", help="database URL to use as is (default: a fresh scratch SQLite file)")
+    data.add_argument("--generate", action="store_true", help="fill the (empty) --database with synthetic data first")
+    run = parser.add_argument_group("load")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--requests", type=int, default=50, help="requests per thread")
+    run.add_argument("--seed", type=int, default=1)
+    out = parser.add_argument_group("output")
+    out.add_argument("--out", help="write the JSON report here (default stdout)")
+    out.add_argument("--baseline", help="diff against this stored report; exit 1 on regression")
+    out.add_argument("--tolerance", type=float, default=0.10, help="allowed regression as a fraction")
+    out.add_argument("--save-baseline", help="also store this run's report as a baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.database:
+        os.environ["DATABASE_URL"] = args.database
+    else:
+        workdir = tempfile.mkdtemp(prefix="benchmark-")
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+
+    from app import create_app
+    from benchmark import datagen, driver, report
+
+    app = create_app(TESTING=True)
+    with app.app_context():
+        generated = {} if args.database and not args.generate else datagen.generate(
+            users=max(args.users, args.concurrency), activities=args.activities, listings=args.listings,
+            transactions=args.transactions, offsets=args.offsets, seed=args.seed,
+        )
+    result = driver.run(app, concurrency=args.concurrency, requests=args.requests, seed=args.seed)
+    summary = report.summarize(result, {
+        "concurrency": args.concurrency, "requests_per_thread": args.requests,
+        "database": app.config["SQLALCHEMY_DATABASE_URI"].split(":", 1)[0], "generated": generated,
+    })
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            changes, regressions = report.diff(summary, json.load(f), args.tolerance)
+        summary["diff"] = {"baseline": args.baseline, "changes": changes, "regressions": regressions}
+        failed = bool(regressions)
+
+    text = json.dumps(summary, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(text + "\n")
+    if failed:
+        print("Regressions: " + ", ".join(summary["diff"]["regressions"]), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import random
+import sys
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from models import db, User, Activity, MarketplaceListing, Transaction, OffsetProgram, OffsetTransaction
+from emission_factors import EMISSION_FACTORS
+from setup_emission_factors import initialize_emission_factors
+from migrations import upgrade
+import analytics
+import ledger
+import recalc
+
+PASSWORD = "bench"
+INSERT_CHUNK = 10000
+FIRST_DAY = date(2024, 1, 1)
+PROGRAMS = [
+    ("Tree Plantation Drive", "Funds planting of new trees.", 0.5),
+    ("Renewable Energy Project", "Invests in solar/wind energy.", 0.8),
+    ("Ocean Cleanup Program", "Supports ocean plastic cleanup.", 1.0),
+]
+
+
+def generate(users=100, activities=50, listings=500, transactions=1000, offsets=200, days=365, seed=1):
+    """Fill an empty database with synthetic data. Run inside an app context.
+
+    `activities` is per user; listings, transactions and offsets are totals
+    spread across random users. Emission records and the daily rollup are
+    derived with recalc, and every balance gets an opening ledger journal.
+    Returns {table: rows written}.
+    """
+    rng = random.Random(seed)
+    upgrade()
+    with redirect_stdout(sys.stderr):  # it reports with print(); stdout may be carrying the JSON report
+        initialize_emission_factors()
+    if not OffsetProgram.query.count():
+        db.session.add_all([OffsetProgram(name=n, description=d, rate_per_kg=r) for n, d, r in PROGRAMS])
+    password = generate_password_hash(PASSWORD)
+    _insert(User, [
+        {"username": f"bench{i}", "password": password,
+         "credits": round(rng.uniform(50, 500), 3), "wallet_balance": round(rng.uniform(5000, 50000), 2)}
+        for i in range(users)
+    ])
+    user_ids = [i for (i,) in db.session.query(User.id).filter(User.username.like("bench%")).order_by(User.id)]
+    program_ids = [i for (i,) in db.session.query(OffsetProgram.id)]
+    activity_types = sorted(EMISSION_FACTORS)
+
+    def day():
+        return FIRST_DAY + timedelta(days=rng.randrange(days))
+
+    def moment():
+        return datetime.combine(day(), datetime.min.time()) + timedelta(seconds=rng.randrange(86400))
+
+    _insert(Activity, (
+        {"user_id": user_id, "activity_type": rng.choice(activity_types), "description": None,
+         "amount": round(rng.uniform(1, 200), 2), "unit": "unit", "date": day()}
+        for user_id in user_ids for _ in range(activities)
+    ))
+    _insert(MarketplaceListing, (
+        {"user_id": rng.choice(user_ids), "credits": (credits := round(rng.uniform(0.5, 20), 2)),
+         "price_per_credit": (price := round(rng.uniform(5, 15), 2)), "total_price": credits * price,
+         "status": "available", "created_at": moment()}
+        for _ in range(listings)
+    ))
+    _insert(Transaction, (
+        {"buyer_id": buyer, "seller_id": seller, "credits_transferred": (credits := round(rng.uniform(0.5, 20), 2)),
+         "total_amount": credits * rng.uniform(5, 15), "created_at": moment()}
+        for buyer, seller in (rng.sample(user_ids, 2) for _ in range(transactions if len(user_ids) > 1 else 0))
+    ))
+    _insert(OffsetTransaction, (
+        {"user_id": rng.choice(user_ids), "program_id": rng.choice(program_ids),
+         "co2_offset": (co2 := round(rng.uniform(1, 100), 2)), "credits_used": co2 * 0.5, "created_at": moment()}
+        for _ in range(offsets if program_ids else 0)
+    ))
+    db.session.commit()
+    emission_days = recalc.recalculate()
+    ledger.backfill()
+    analytics.rebuild()
+    db.session.commit()
+    return {"users": len(user_ids), "activities": len(user_ids) * activities, "listings": listings,
+            "transactions": transactions, "offsets": offsets, "emission_days": emission_days}
+
+
+def _insert(model, rows):
+    rows = iter(rows)
+    while True:
+        chunk = [row for _, row in zip(range(INSERT_CHUNK), rows)]
+        if not chunk:
+            return
+        db.session.execute(insert(model), chunk)
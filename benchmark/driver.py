@@ -0,0 +1,119 @@
+import random
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import event
+
+from models import db, User, MarketplaceListing, OffsetProgram
+from benchmark.datagen import PASSWORD
+
+# route name -> relative weight in the request mix
+MIX = {
+    "login": 1,
+    "dashboard": 8,
+    "activity_entry": 2,
+    "emission": 2,
+    "marketplace": 6,
+    "buy": 1,
+    "offset": 2,
+}
+
+
+class QueryCounter:
+    """Counts statements per thread through the engine's before_cursor_execute event."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._local = threading.local()
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, "count", 0) + 1
+
+    def take(self):
+        count, self._local.count = getattr(self._local, "count", 0), 0
+        return count
+
+
+def _requests(client, username, rng, listing_ids, program_ids):
+    """route name -> callable issuing one request of that route."""
+    activity_form = {
+        "activity_type[]": ["Electricity Usage", "Bus Travel", "Train Travel"],
+        "description[]": ["", "", ""], "amount[]": ["42", "12", "30"],
+        "unit[]": ["kWh", "km", "km"], "date[]": ["2024-06-01", "2024-06-01", "2024-06-02"],
+    }
+    return {
+        "login": lambda: client.post("/login", data={"username": username, "password": PASSWORD}),
+        "dashboard": lambda: client.get("/dashboard"),
+        "activity_entry": lambda: client.post("/activity_entry", data=activity_form),
+        "emission": lambda: client.post("/emission", data={"date": "2024-06-01"}),
+        "marketplace": lambda: client.get("/marketplace"),
+        "buy": lambda: client.post(f"/buy/{rng.choice(listing_ids)}"),
+        "offset": lambda: (
+            client.post("/offset", data={"program_id": rng.choice(program_ids), "co2_amount": "1"})
+            if rng.random() < 0.5 else client.get("/offset")
+        ),
+    }
+
+
+def run(app, concurrency=8, requests=50, mix=None, seed=1):
+    """Drive the routes from `concurrency` threads, each logged in as its own user.
+
+    Each thread issues `requests` requests drawn from `mix` (route -> weight).
+    Returns {"elapsed": seconds, "samples": {route: [(latency s, queries, status), ...]}}.
+    """
+    mix = mix or MIX
+    with app.app_context():
+        usernames = [u for (u,) in db.session.query(User.username)
+                     .filter(User.username.like("bench%")).order_by(User.id).limit(concurrency)]
+        listing_ids = [i for (i,) in db.session.query(MarketplaceListing.id)
+                       .filter(MarketplaceListing.status == "available")]
+        program_ids = [i for (i,) in db.session.query(OffsetProgram.id)]
+        engine = db.engine
+    if len(usernames) < concurrency:
+        raise ValueError(f"need {concurrency} generated users, found {len(usernames)}")
+
+    samples = defaultdict(list)
+    errors = []
+    lock = threading.Lock()
+    start = threading.Barrier(concurrency + 1)
+
+    def worker(i, counter):
+        rng = random.Random(seed + i)
+        client = app.test_client()
+        client.post("/login", data={"username": usernames[i], "password": PASSWORD})
+        calls = _requests(client, usernames[i], rng, listing_ids or [0], program_ids or [0])
+        routes = rng.choices(list(mix), weights=list(mix.values()), k=requests)
+        local = []
+        start.wait()
+        for route in routes:
+            counter.take()
+            began = time.perf_counter()
+            try:
+                status = calls[route]().status_code
+            except Exception as e:  # record and keep going; a 500 is a result too
+                status = 599
+                with lock:
+                    errors.append(f"{route}: {e!r}")
+            local.append((route, time.perf_counter() - began, counter.take(), status))
+        with lock:
+            for route, latency, queries, status in local:
+                samples[route].append((latency, queries, status))
+
+    with QueryCounter(engine) as counter:
+        threads = [threading.Thread(target=worker, args=(i, counter)) for i in range(concurrency)]
+        for t in threads:
+            t.start()
+        start.wait()
+        began = time.perf_counter()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - began
+    return {"elapsed": elapsed, "samples": dict(samples), "errors": errors}
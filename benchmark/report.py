@@ -0,0 +1,60 @@
+import numpy as np
+
+# metric -> +1 if bigger is worse, -1 if smaller is worse
+METRICS = {
+    "p50_ms": 1, "p95_ms": 1, "p99_ms": 1, "mean_ms": 1,
+    "throughput_rps": -1, "queries_mean": 1,
+}
+
+
+def summarize(result, meta=None):
+    """Per-route and overall latency percentiles, throughput and query counts as a JSON-ready dict."""
+    elapsed = result["elapsed"]
+    routes = {route: _stats(samples, elapsed) for route, samples in sorted(result["samples"].items())}
+    everything = [s for samples in result["samples"].values() for s in samples]
+    return {
+        "meta": dict(meta or {}, elapsed_s=round(elapsed, 3)),
+        "overall": _stats(everything, elapsed) if everything else {},
+        "routes": routes,
+        "errors": result.get("errors", [])[:20],
+    }
+
+
+def _stats(samples, elapsed):
+    latencies = np.array([s[0] for s in samples]) * 1000
+    queries = np.array([s[1] for s in samples])
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "count": len(samples),
+        "errors": sum(1 for s in samples if s[2] >= 500),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "queries_mean": round(float(queries.mean()), 2),
+        "queries_max": int(queries.max()),
+    }
+
+
+def diff(current, baseline, tolerance=0.10):
+    """Compare two summaries route by route.
+
+    Returns (changes, regressions): changes maps route -> metric ->
+    {baseline, current, change_pct}; regressions lists "route metric"
+    strings that got worse by more than `tolerance` (a fraction).
+    """
+    changes, regressions = {}, []
+    for route in sorted(set(current["routes"]) & set(baseline["routes"])):
+        now, then = current["routes"][route], baseline["routes"][route]
+        changes[route] = {}
+        for metric, worse in METRICS.items():
+            if metric not in now or metric not in then:
+                continue
+            change = (now[metric] - then[metric]) / then[metric] if then[metric] else 0.0
+            changes[route][metric] = {
+                "baseline": then[metric], "current": now[metric], "change_pct": round(change * 100, 1),
+            }
+            if change * worse > tolerance:
+                regressions.append(f"{route} {metric}")
+    return changes, regressions
@@ -0,0 +1,136 @@
+"""Startup-time benchmark: what a gunicorn worker spawn or a cron job pays before doing any work.
+
+    python -m benchmark.startup --runs 10 --out startup.json
+    python -m benchmark.startup --baseline startup.json       # exit 1 on regression
+    python -m benchmark.startup --imports 20                  # also list the slowest imports of create_app()
+
+Each scenario runs in a fresh interpreter (after one discarded warm-up run
+that fills the bytecode cache) against a scratch SQLite database, and its
+wall-clock time is reported like a route in the main benchmark, so
+report.diff compares runs.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark import report
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHOW_MODULES = "; import sys; print(len(sys.modules))"
+
+# name -> python -c snippet (prints how many modules ended up loaded) or cli.py arguments
+SCENARIOS = {
+    "import_app": "import app",
+    "web_app": "from app import create_app; create_app()",
+    "web_first_request": "from app import create_app; create_app().test_client().get('/')",
+    "cli_app": "from cli import create_app; create_app()",
+    "cli_expire_listings": ["expire-listings"],
+    "cli_recompute_if_stale": ["recompute", "--if-stale"],
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark.startup", description="Benchmark app and CLI startup.")
+    parser.add_argument("--runs", type=int, default=10, help="timed runs per scenario")
+    parser.add_argument("--imports", type=int, default=0, help="list the N slowest imports of create_app()")
+    parser.add_argument("--out", help="write the JSON report here (default stdout)")
+    parser.add_argument("--baseline", help="diff against this stored report; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed regression as a fraction")
+    parser.add_argument("--save-baseline", help="also store this run's report as a baseline")
+    return parser.parse_args(argv)
+
+
+def command(scenario):
+    if isinstance(scenario, list):
+        return [sys.executable, "cli.py", *scenario]
+    return [sys.executable, "-c", scenario + SHOW_MODULES]
+
+
+def run_once(argv, env):
+    start = time.perf_counter()
+    done = subprocess.run(argv, cwd=ROOT, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if done.returncode:
+        raise RuntimeError(f"{' '.join(argv)} failed:\n{done.stderr}")
+    return elapsed, done.stdout
+
+
+def measure(scenario, runs, env):
+    argv = command(scenario)
+    run_once(argv, env)  # warm-up: compiles bytecode, fills the OS page cache
+    samples, modules = [], None
+    for _ in range(runs):
+        elapsed, stdout = run_once(argv, env)
+        samples.append(elapsed * 1000)
+        if not isinstance(scenario, list):
+            modules = int(stdout.split()[-1])
+    p50, p95 = np.percentile(samples, [50, 95])
+    stats = {
+        "count": runs,
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "mean_ms": round(float(np.mean(samples)), 3),
+        "min_ms": round(float(np.min(samples)), 3),
+    }
+    if modules is not None:
+        stats["modules"] = modules
+    return stats
+
+
+def slowest_imports(env, limit):
+    """[(module, cumulative ms)] of the top-level imports create_app() triggers, slowest first (python -X importtime)."""
+    done = subprocess.run([sys.executable, "-X", "importtime", "-c", SCENARIOS["web_app"]],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+    rows = []
+    for line in done.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, total, name = line[len("import time:"):].split("|")
+        if name.startswith("  "):
+            continue  # imported by another module; counted in its parent's cumulative time
+        rows.append((name.strip(), round(int(total) / 1000, 2)))
+    return sorted(rows, key=lambda row: -row[1])[:limit]
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="startup-")
+    env = dict(os.environ, DATABASE_URL="sqlite:///" + os.path.join(workdir, "startup.db"))
+    run_once(command(["init-db"]), env)
+
+    summary = {
+        "meta": {"runs": args.runs, "python": sys.version.split()[0]},
+        "routes": {name: measure(scenario, args.runs, env) for name, scenario in SCENARIOS.items()},
+    }
+    if args.imports:
+        summary["slowest_imports"] = slowest_imports(env, args.imports)
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            changes, regressions = report.diff(summary, json.load(f), args.tolerance)
+        summary["diff"] = {"baseline": args.baseline, "changes": changes, "regressions": regressions}
+        failed = bool(regressions)
+
+    text = json.dumps(summary, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(text + "\n")
+    if failed:
+        print("Regressions: " + ", ".join(summary["diff"]["regressions"]), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
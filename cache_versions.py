@@ -0,0 +1,40 @@
+from sqlalchemy import func, update
+
+from models import db, CacheVersion, User
+
+
+# Version stamps shared by every worker through the database.
+# Writers bump a stamp in the same transaction as their change; readers
+# compare it with the stamp they loaded to decide whether to reload.
+def get_version(name):
+    version = db.session.query(CacheVersion.version).filter_by(name=name).scalar()
+    return version or 0
+
+def bump_version(name):
+    """Increment the stamp inside the current transaction and return its new value."""
+    updated = CacheVersion.query.filter_by(name=name).update(
+        {CacheVersion.version: CacheVersion.version + 1}, synchronize_session=False
+    )
+    if not updated:
+        db.session.add(CacheVersion(name=name, version=1))
+        db.session.flush()
+        return 1
+    return get_version(name)
+
+
+# Per-user stamp, kept on the User row so load_user already carries it.
+# Bump it with every write to the user's balances, activities or history.
+def next_data_version(*user_ids):
+    """SET value that bumps User.data_version inside an UPDATE of the rows of `user_ids`."""
+    touch_users(user_ids)
+    return func.coalesce(User.data_version, 0) + 1
+
+def bump_data_versions(user_ids):
+    if user_ids:
+        ids = sorted(set(user_ids))
+        db.session.execute(update(User).where(User.id.in_(ids)).values(data_version=next_data_version(*ids)))
+
+
+# Users whose row the current transaction changed; user_cache drops them on commit.
+def touch_users(user_ids):
+    db.session.info.setdefault("touched_users", set()).update(user_ids)
@@ -0,0 +1,214 @@
+"""Maintenance commands, runnable without the web app:
+
+    flask --app cli seed-factors        # or: python cli.py seed-factors
+    flask --app cli recompute --if-stale
+
+The app built here only sets up the database layer (no blueprints, login
+manager, caches or workers), and each command imports the modules it
+needs when it runs, so a cron job pays for SQLAlchemy and its own work
+only. create_app() in app.py registers the same commands, so
+`flask --app app <command>` keeps working.
+"""
+import click
+from flask import Flask
+from flask.cli import AppGroup, FlaskGroup
+
+from config import Config
+from database import init_db
+from export import FORMATS
+
+commands = AppGroup("commands")
+
+
+def create_app(config=Config):
+    """A database-only app for the commands below."""
+    app = Flask(__name__)
+    app.config.from_object(config)
+    init_db(app)
+    register_commands(app)
+    return app
+
+def register_commands(app):
+    for command in commands.commands.values():
+        app.cli.add_command(command)
+
+
+# --- Schema and reference data ---
+@commands.command("upgrade-db")
+def upgrade_db_command():
+    """Create missing tables, columns and indexes on an existing database."""
+    from migrations import upgrade
+    created = upgrade()
+    print(f"Created: {', '.join(created) or 'nothing, schema is current'}.")
+
+@commands.command("seed-factors")
+@click.option("--from", "valid_from", type=click.DateTime(["%Y-%m-%d"]),
+              help="Date changed factors take effect (default today).")
+def seed_factors_command(valid_from):
+    """Add missing emission factors; changed defaults become new revisions."""
+    from setup_emission_factors import initialize_emission_factors
+    initialize_emission_factors(valid_from and valid_from.date())
+
+@commands.command("seed-programs")
+def seed_programs_command():
+    """Add the default offset programs to an empty catalog."""
+    from setup_offset_programs import initialize_offset_programs
+    if not initialize_offset_programs():
+        print("Offset programs already present.")
+
+@commands.command("init-db")
+def init_db_command():
+    """Upgrade the schema, seed reference data, open ledger accounts and fill empty rollups (safe to re-run)."""
+    initialize_database()
+
+def initialize_database():
+    from models import db
+    from migrations import upgrade
+    from setup_emission_factors import initialize_emission_factors
+    from setup_offset_programs import initialize_offset_programs
+    import ledger
+    upgrade()
+    initialize_emission_factors()
+    initialize_offset_programs()
+    # Balances that predate the ledger (or changed before it was backfilled) get their opening journals
+    ledger.backfill()
+    db.session.commit()
+    rebuild_empty_rollups()
+
+def rebuild_empty_rollups():
+    """Fill the daily rollup and the analytics tables when a database from before them has data but they are empty."""
+    from models import (db, Activity, DailyEmission, Transaction, OffsetTransaction,
+                        UserTypeMonth, PriceDaily, ProgramOffsetTotal)
+    import analytics
+    import recalc
+    import rollup
+
+    def gap(aggregate, base):
+        return not db.session.query(aggregate).first() and db.session.query(base.id).first() is not None
+
+    if gap(DailyEmission, Activity):
+        recalc.recalculate()
+        days = rollup.rebuild()
+        db.session.commit()
+        print(f"Rebuilt daily rollup: {days} user-days.")
+    if gap(UserTypeMonth, Activity) or gap(PriceDaily, Transaction) or gap(ProgramOffsetTotal, OffsetTransaction):
+        written = analytics.rebuild()
+        db.session.commit()
+        print("Rebuilt analytics: " + ", ".join(f"{rows} {table} rows" for table, rows in written.items()))
+
+
+# --- Emissions ---
+# flask --app cli recompute [--start YYYY-MM-DD] [--end YYYY-MM-DD] [--user ID ...] [--if-stale]
+@commands.command("recompute")
+@click.option("--start", type=click.DateTime(["%Y-%m-%d"]), help="First date to recompute.")
+@click.option("--end", type=click.DateTime(["%Y-%m-%d"]), help="Last date to recompute.")
+@click.option("--user", "user_ids", type=int, multiple=True, help="Only these user ids.")
+@click.option("--if-stale", is_flag=True, help="Only run if emission factors changed since the last full run.")
+def recompute_command(start, end, user_ids, if_stale):
+    """Recompute daily emissions from activities with the current emission factors."""
+    import recalc
+    if if_stale:
+        ran = recalc.recompute_if_stale()
+        print("Recomputed all users." if ran else "Emissions are current.")
+        return
+    days = recalc.recalculate(start and start.date(), end and end.date(), list(user_ids) or None)
+    print(f"Recomputed {days} user-days.")
+
+@commands.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Deduplicate EmissionRecord history and rebuild the daily emission rollup."""
+    from models import db
+    import recalc
+    from rollup import rebuild
+    db.create_all()
+    recalc.recalculate()
+    days = rebuild()
+    db.session.commit()
+    print(f"Rebuilt daily rollup: {days} user-days.")
+
+# flask --app cli revise-factor "Electricity Usage" 0.71 --from 2025-04-01
+@commands.command("revise-factor")
+@click.argument("activity_type")
+@click.argument("factor", type=float)
+@click.option("--from", "valid_from", type=click.DateTime(["%Y-%m-%d"]), required=True,
+              help="First date the new factor applies to.")
+def revise_factor_command(activity_type, factor, valid_from):
+    """Record a new emission factor for activities dated on or after --from."""
+    from models import db
+    from emission_factors import revise_factors
+    revised = revise_factors({activity_type: factor}, valid_from.date())
+    db.session.commit()
+    if not revised:
+        print(f"{activity_type} already uses {factor} from {valid_from:%Y-%m-%d}.")
+        return
+    print(f"Revised {activity_type} from {valid_from:%Y-%m-%d}. "
+          f"Run 'flask recompute --start {valid_from:%Y-%m-%d}' to reprice stored emissions.")
+
+@commands.command("analytics-rebuild")
+def analytics_rebuild_command():
+    """Recompute the tenant-wide aggregate tables (needed once for databases older than them)."""
+    from models import db
+    import analytics
+    written = analytics.rebuild()
+    db.session.commit()
+    print(", ".join(f"{rows} {table} rows" for table, rows in written.items()))
+
+# flask --app cli export activities --format parquet --out activities.parquet [--start ..] [--end ..] [--user ID ...]
+@commands.command("export")
+@click.argument("kind")
+@click.option("--format", "fmt", type=click.Choice(list(FORMATS)), default="csv")
+@click.option("--out", type=click.File("wb"), default="-", help="Output file (default stdout).")
+@click.option("--start", type=click.DateTime(["%Y-%m-%d"]), help="First date to include.")
+@click.option("--end", type=click.DateTime(["%Y-%m-%d"]), help="Last date to include.")
+@click.option("--user", "user_ids", type=int, multiple=True, help="Only these user ids (default: every user).")
+def export_command(kind, fmt, out, start, end, user_ids):
+    """Stream activities, emissions, transactions or offsets to CSV, NDJSON or Parquet."""
+    from export import ExportError, stream_export
+    try:
+        chunks = stream_export(kind, fmt, list(user_ids) or None, start and start.date(), end and end.date())
+    except ExportError as e:
+        raise click.UsageError(str(e))
+    for chunk in chunks:
+        out.write(chunk)
+
+
+# --- Ledger and marketplace ---
+@commands.command("ledger-backfill")
+def ledger_backfill_command():
+    """Post opening ledger journals for balances and listings the ledger does not cover yet."""
+    from models import db
+    import ledger
+    opened = ledger.backfill()
+    db.session.commit()
+    print(f"Opened ledger accounts for {opened} users.")
+
+@commands.command("ledger-snapshot")
+def ledger_snapshot_command():
+    """Snapshot every user account balance that changed since the last run."""
+    from models import db
+    import ledger
+    written = ledger.take_snapshots()
+    db.session.commit()
+    print(f"Wrote {written} balance snapshots.")
+
+@commands.command("ledger-reconcile")
+def ledger_reconcile_command():
+    """Verify journals, snapshots and user balances against the ledger."""
+    import ledger
+    problems = ledger.reconcile()
+    for problem in problems:
+        print(problem)
+    print(f"{len(problems)} reconciliation problems.")
+    if problems:
+        raise SystemExit(1)
+
+# For cron when no ExpiryWorker runs
+@commands.command("expire-listings")
+def expire_listings_command():
+    """Expire every listing past its expires_at and refund the escrowed credits."""
+    import settlement
+    print(f"Expired {settlement.expire_due()} listings.")
+
+
+if __name__ == "__main__":
+    FlaskGroup(create_app=create_app)()
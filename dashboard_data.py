@@ -0,0 +1,90 @@
+from datetime import date, datetime
+
+from models import db, User, Activity, Transaction, OffsetProgram, OffsetTransaction
+from emission_factors import factor_registry
+from pagination import keyset_page, encode_cursor, decode_cursor
+from rollup import daily_series
+
+
+# Dashboard feeds, shared by the dashboard page and the JSON API.
+# Paged feeds take the raw cursor from the query string and return
+# (items, next_cursor); next_cursor is None on the last page.
+def emission_series(user):
+    return [
+        {"date": day.strftime("%Y-%m-%d"), "amount": round(value, 2)}
+        for day, value in daily_series(user.id)
+    ]
+
+
+def purchases_page(user, cursor=None):
+    rows, more = keyset_page(
+        db.session.query(Transaction, User.username)
+        .join(User, Transaction.seller_id == User.id)
+        .filter(Transaction.buyer_id == user.id),
+        Transaction.created_at, Transaction.id, decode_cursor(cursor, datetime, int),
+    )
+    items = [
+        {
+            "date": t.Transaction.created_at.strftime("%Y-%m-%d"),
+            "program_name": f"Bought from {t.username}",
+            "credits_used": t.Transaction.credits_transferred,
+        }
+        for t in rows
+    ]
+    last = rows[-1].Transaction if more else None
+    return items, last and encode_cursor(last.created_at, last.id)
+
+
+def offsets_page(user, cursor=None):
+    rows, more = keyset_page(
+        db.session.query(OffsetTransaction, OffsetProgram)
+        .join(OffsetProgram, OffsetTransaction.program_id == OffsetProgram.id)
+        .filter(OffsetTransaction.user_id == user.id),
+        OffsetTransaction.created_at, OffsetTransaction.id, decode_cursor(cursor, datetime, int),
+    )
+    items = [
+        {
+            "date": record.OffsetTransaction.created_at.strftime("%Y-%m-%d"),
+            "program_name": record.OffsetProgram.name,
+            "co2_offset": record.OffsetTransaction.co2_offset,
+            "credits_spent": record.OffsetTransaction.credits_used,
+        }
+        for record in rows
+    ]
+    last = rows[-1].OffsetTransaction if more else None
+    return items, last and encode_cursor(last.created_at, last.id)
+
+
+def activities_page(user, filter_date=None, cursor=None):
+    """Activity history, newest first, with each row's emission and the running credit balance.
+
+    The cursor carries the running balance at the end of the previous page,
+    so page N continues the prefix without reading pages 1..N-1.
+    """
+    query = Activity.query.filter_by(user_id=user.id)
+    if filter_date:
+        try:
+            query = query.filter(Activity.date == datetime.strptime(filter_date, "%Y-%m-%d").date())
+        except ValueError:
+            pass
+    after = decode_cursor(cursor, date, int, float)
+    rows, more = keyset_page(query, Activity.date, Activity.id, after and after[:2])
+
+    # Emission factors in effect on each activity's date
+    factors = factor_registry.factors_at([a.activity_type for a in rows], [a.date for a in rows])
+
+    items = []
+    remaining_credits = after[2] if after else user.credits
+    for act, factor in zip(rows, factors.tolist()):
+        emission = act.amount * factor  # kg CO₂e
+        remaining_credits -= emission / 1000  # convert to tonnes
+        items.append({
+            "date": act.date.strftime("%Y-%m-%d"),
+            "type": act.activity_type,
+            "unit": act.unit,
+            "amount": act.amount,
+            "emission": round(emission, 2),
+            "remaining_credits": round(remaining_credits, 3)
+        })
+    last = rows[-1] if more else None
+    return items, last and encode_cursor(last.date, last.id, remaining_credits)
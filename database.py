@@ -0,0 +1,84 @@
+import os
+import weakref
+from functools import partial
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from models import db
+
+
+def normalize_url(url):
+    """Accept the postgres:// scheme some hosts hand out; SQLAlchemy only knows postgresql://."""
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database.
+
+    SQLite gets a driver-level busy timeout so writers queue instead of
+    failing with "database is locked". Server databases get a sized pool
+    that pings connections before handing them out and recycles them
+    before the server or a proxy drops them; psycopg 3 also prepares hot
+    statements server-side.
+    """
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    options = {"query_cache_size": config.get("DB_STATEMENT_CACHE_SIZE", 1000)}
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"timeout": config.get("SQLITE_BUSY_TIMEOUT_MS", 5000) / 1000}
+        return options
+    options.update(
+        pool_size=config.get("DB_POOL_SIZE", 10),
+        max_overflow=config.get("DB_MAX_OVERFLOW", 20),
+        pool_recycle=config.get("DB_POOL_RECYCLE", 1800),
+        pool_pre_ping=True,
+    )
+    if url.get_driver_name() == "psycopg":
+        options["connect_args"] = {"prepare_threshold": config.get("DB_PREPARE_THRESHOLD", 5)}
+    return options
+
+
+def init_db(app):
+    """Bind db to app with the engine options above and the SQLite connection pragmas.
+
+    A forked child (gunicorn --preload) drops the pool it inherited without
+    closing the parent's connections, so the processes never share a socket.
+    """
+    app.config["SQLALCHEMY_DATABASE_URI"] = normalize_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **engine_options(app.config), **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    }
+    db.init_app(app)
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            event.listen(db.engine, "connect", _sqlite_pragmas(app.config))
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=partial(_forget_pool, weakref.ref(db.engine)))
+
+
+def _forget_pool(engine_ref):
+    engine = engine_ref()
+    if engine is not None:
+        engine.dispose(close=False)  # the parent still owns those connections
+
+
+def _sqlite_pragmas(config):
+    # WAL lets dashboard reads proceed while a trade commits; NORMAL syncs
+    # only at checkpoints, which WAL keeps crash-safe (a power cut can lose
+    # the last commits but never corrupts the file).
+    pragmas = [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA busy_timeout={int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}",
+        f"PRAGMA mmap_size={int(config.get('SQLITE_MMAP_SIZE', 0))}",
+    ]
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return on_connect
@@ -0,0 +1,44 @@
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from models import db
+
+RETRYABLE_SQLSTATES = {"40001", "40P01"}  # Postgres serialization_failure, deadlock_detected
+
+
+def is_retryable(error):
+    """True for errors a re-run of the same transaction can get past.
+
+    Covers SQLite busy/locked, Postgres serialization failures and
+    deadlocks, and dropped connections.
+    """
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    if not isinstance(error, OperationalError):
+        return False
+    sqlstate = getattr(error.orig, "sqlstate", None) or getattr(error.orig, "pgcode", None)  # psycopg 3 / psycopg2
+    if sqlstate in RETRYABLE_SQLSTATES:
+        return True
+    message = str(error.orig).lower()
+    return "locked" in message or "busy" in message
+
+
+def upsert(model, rows, index_elements, update):
+    """INSERT ... ON CONFLICT (index_elements) DO UPDATE for SQLite and Postgres.
+
+    `update` maps column names to values or to a callable taking the
+    `excluded` pseudo-table, e.g. {"total": lambda ex: Model.total + ex.total}.
+    An empty `update` means DO NOTHING. Returns the result.
+    """
+    if not rows:
+        return None
+    dialect = postgresql if db.session.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(model)
+    if not update:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={k: (v(stmt.excluded) if callable(v) else v) for k, v in update.items()},
+        )
+    return db.session.execute(stmt, rows)
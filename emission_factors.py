@@ -0,0 +1,208 @@
+import threading
+from bisect import bisect_right
+from datetime import date
+
+import numpy as np
+
+from models import db, EmissionFactor, EmissionFactorVersion
+from cache_versions import get_version, bump_version
+from db_helpers import upsert
+
+FACTOR_VERSION_KEY = "emission_factors"
+DEFAULT_FACTOR = 0.1   # kg CO₂e per unit for activity types with no factor
+OPENING_DATE = date.min  # valid_from of the factor a type had before its first revision
+_DAY_BITS = 32          # interval keys pack (type code, day number) into one int64
+
+# Emission Factors (kg CO₂e/unit)
+EMISSION_FACTORS = {
+    # --- Home Energy ---
+    "Electricity Usage": 0.82, "Natural Gas Usage": 1.90, "LPG Usage": 1.55,
+    "Biogas Usage": 0.10, "Heating Oil": 2.70, "Coal Usage": 2.40,
+    "Renewable Energy Purchase": -0.82,
+
+    # --- Transport ---
+    "Car (Petrol) Travel": 0.21, "Car (Diesel) Travel": 0.25,
+    "Motorcycle Travel": 0.07, "Bus Travel": 0.09,
+    "Train Travel": 0.04, "Metro Travel": 0.05,
+    "Flight - Domestic": 0.18, "Flight - International": 0.14,
+    "Electric Vehicle Travel": 0.10, "Bicycle Travel": 0.00,
+
+    # --- Food & Diet ---
+    "Mutton Consumption": 24.0, "Chicken Consumption": 6.9,
+    "Fish Consumption": 5.5, "Dairy Consumption": 1.2,
+    "Vegetarian Diet": 3.5, "Vegan Diet": 2.5,
+
+    # --- Goods & Services ---
+    "Clothing Purchase": 0.005, "Electronics Purchase": 0.008,
+    "Furniture Purchase": 0.006, "Waste Generated": 1.0,
+
+    # --- Offsets ---
+    "Tree Planting": -20, "Carbon Credit Purchase": -1000,
+    "Renewable Energy Support": -500, "Biogas Program Support": -300
+}
+
+class FactorIndex:
+    """Immutable as-of index of emission factors by activity type.
+
+    Each type has a sorted list of (valid_from, factor) intervals; an
+    interval runs until the next one starts, and the first starts at
+    OPENING_DATE. Types without revisions have a single interval holding
+    their EmissionFactor (or in-code) factor. `factor_at` bisects one
+    type's starts; `factors_at` packs (type, day) into int64 keys and
+    resolves a whole batch with one np.searchsorted over all intervals.
+    """
+
+    def __init__(self, base, versions):
+        intervals = {t: ([OPENING_DATE], [f]) for t, f in base.items()}
+        revised = {}
+        for activity_type, valid_from, factor in sorted(versions):
+            starts, factors = revised.setdefault(activity_type, ([], []))
+            starts.append(valid_from)
+            factors.append(factor)
+        for starts, _ in revised.values():
+            starts[0] = OPENING_DATE  # the earliest factor also covers older dates
+        intervals.update(revised)
+        self._intervals = intervals
+        self._codes = {t: code for code, t in enumerate(sorted(intervals))}
+
+        keys, values = [], []
+        for activity_type, code in self._codes.items():
+            starts, factors = intervals[activity_type]
+            days = np.array(starts, dtype="datetime64[D]").astype(np.int64)
+            keys.append(self._pack(code, days))
+            values.append(np.array(factors, dtype=float))
+        self._keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+        self._values = np.concatenate(values) if values else np.empty(0, dtype=float)
+
+    @staticmethod
+    def _pack(codes, days):
+        return (np.asarray(codes, dtype=np.int64) << _DAY_BITS) + (np.asarray(days, dtype=np.int64) + (1 << (_DAY_BITS - 1)))
+
+    def is_revised(self, activity_type):
+        return len(self._intervals.get(activity_type, ((), ()))[0]) > 1
+
+    def factor_at(self, activity_type, on, default=DEFAULT_FACTOR):
+        """Factor in effect for `activity_type` on date `on`, in O(log n) revisions."""
+        interval = self._intervals.get(activity_type)
+        if interval is None:
+            return default
+        starts, factors = interval
+        return factors[max(bisect_right(starts, on) - 1, 0)]
+
+    def factors_at(self, activity_types, dates, default=DEFAULT_FACTOR):
+        """Vectorized factor_at: an array of factors for parallel sequences of types and dates."""
+        activity_types = np.asarray(activity_types, dtype=object)
+        if not len(activity_types):
+            return np.empty(0, dtype=float)
+        kinds, inverse = np.unique(activity_types, return_inverse=True)
+        codes = np.array([self._codes.get(k, -1) for k in kinds], dtype=np.int64)[inverse]
+        days = np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+        known = codes >= 0
+        positions = np.searchsorted(self._keys, self._pack(codes[known], days[known]), side="right") - 1
+        factors = np.full(len(activity_types), default, dtype=float)
+        factors[known] = self._values[positions]
+        return factors
+
+    def current(self, on=None):
+        """{activity_type: factor} in effect on `on` (default today)."""
+        on = on or date.today()
+        return {t: self.factor_at(t, on) for t in self._intervals}
+
+
+class FactorRegistry:
+    """Process-wide cache of the emission factor tables.
+
+    EmissionFactor and EmissionFactorVersion are loaded once into a
+    FactorIndex. The stamp stored under FACTOR_VERSION_KEY is checked on
+    each `index()` call, so a bump from any worker (see `invalidate`) makes
+    every process reload on its next request. Types missing from the
+    tables fall back to the in-code EMISSION_FACTORS.
+    """
+
+    def __init__(self, defaults):
+        self._defaults = dict(defaults)
+        self._index = FactorIndex(defaults, [])
+        self._factors = dict(defaults)
+        self._loaded_on = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def index(self):
+        version = get_version(FACTOR_VERSION_KEY)
+        if version != self._version or self._loaded_on != date.today():
+            with self._lock:
+                if version != self._version or self._loaded_on != date.today():
+                    base = dict(self._defaults)
+                    base.update(db.session.query(EmissionFactor.activity_type, EmissionFactor.factor))
+                    versions = db.session.query(
+                        EmissionFactorVersion.activity_type, EmissionFactorVersion.valid_from,
+                        EmissionFactorVersion.factor,
+                    ).all()
+                    self._index = FactorIndex(base, versions)
+                    self._factors = self._index.current()
+                    self._loaded_on = date.today()
+                    self._version = version
+        return self._index
+
+    def version(self):
+        """Stamp of the factors currently served; changes whenever pricing may change."""
+        self.index()
+        return self._version
+
+    def factors(self):
+        """{activity_type: factor} in effect today."""
+        self.index()
+        return self._factors
+
+    def get(self, activity_type, default=DEFAULT_FACTOR):
+        return self.factors().get(activity_type, default)
+
+    def factor_at(self, activity_type, on, default=DEFAULT_FACTOR):
+        return self.index().factor_at(activity_type, on, default)
+
+    def factors_at(self, activity_types, dates, default=DEFAULT_FACTOR):
+        return self.index().factors_at(activity_types, dates, default)
+
+    def invalidate(self):
+        # Caller commits; the bump lands atomically with the factor changes.
+        bump_version(FACTOR_VERSION_KEY)
+        self._version = None
+
+
+factor_registry = FactorRegistry(EMISSION_FACTORS)
+
+
+def revise_factors(factors, valid_from):
+    """Record new factors effective from `valid_from`, keeping earlier ones for older dates. Caller commits.
+
+    Types whose factor on `valid_from` is already the given one are left
+    alone. The first revision of a type also records the factor it had
+    until then (DEFAULT_FACTOR for new types), so activities before
+    `valid_from` keep their pricing.
+    EmissionFactor is kept at the factor in effect today. Returns the
+    revised activity types.
+    """
+    index = factor_registry.index()
+    rows = []
+    for activity_type, factor in factors.items():
+        if index.factor_at(activity_type, valid_from) == factor:
+            continue
+        if not index.is_revised(activity_type):
+            rows.append({"activity_type": activity_type, "valid_from": OPENING_DATE,
+                         "factor": index.factor_at(activity_type, OPENING_DATE)})
+        rows.append({"activity_type": activity_type, "valid_from": valid_from, "factor": factor})
+    if not rows:
+        return []
+    upsert(EmissionFactorVersion, rows, index_elements=["activity_type", "valid_from"],
+           update={"factor": lambda ex: ex.factor})
+    factor_registry.invalidate()
+
+    today = factor_registry.index().current()
+    revised = sorted({r["activity_type"] for r in rows})
+    existing = {f.activity_type: f for f in EmissionFactor.query.filter(EmissionFactor.activity_type.in_(revised))}
+    for activity_type in revised:
+        if activity_type in existing:
+            existing[activity_type].factor = today[activity_type]
+        else:
+            db.session.add(EmissionFactor(activity_type=activity_type, factor=today[activity_type]))
+    return revised
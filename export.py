@@ -0,0 +1,186 @@
+import csv
+import io
+import json
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import Date, DateTime, Float, Integer, or_, select
+
+from models import db, Activity, EmissionRecord, Transaction, OffsetTransaction
+
+CHUNK_SIZE = 10000  # rows fetched per round trip and written per output chunk / Parquet row group
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+class Export:
+    """One exportable table: its columns, the column date filters apply to, and its owner columns."""
+
+    def __init__(self, model, columns, date_column, user_columns):
+        self.model = model
+        self.columns = [getattr(model, c) for c in columns]
+        self.date_column = getattr(model, date_column)
+        self.user_columns = [getattr(model, c) for c in user_columns]
+
+    @property
+    def names(self):
+        return [c.key for c in self.columns]
+
+
+EXPORTS = {
+    "activities": Export(Activity, ["id", "user_id", "date", "activity_type", "description", "amount", "unit",
+                                    "created_at"], "date", ["user_id"]),
+    "emissions": Export(EmissionRecord, ["id", "user_id", "date", "emission_value"], "date", ["user_id"]),
+    "transactions": Export(Transaction, ["id", "buyer_id", "seller_id", "credits_transferred", "total_amount",
+                                         "created_at"], "created_at", ["buyer_id", "seller_id"]),
+    "offsets": Export(OffsetTransaction, ["id", "user_id", "program_id", "co2_offset", "credits_used",
+                                          "created_at"], "created_at", ["user_id"]),
+}
+
+
+# --- Reading ---
+def export_chunks(kind, user_ids=None, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """Lists of row tuples for `kind`, streamed from a server-side cursor.
+
+    Filters: rows owned by any of `user_ids` (buyer or seller for trades)
+    and dated within [start, end], both inclusive. Full exports come in id
+    order (a primary-key walk); user exports in date order, which the
+    (user, date) indexes return without a sort.
+    """
+    export = EXPORTS[kind]
+    query = select(*export.columns)
+    if user_ids is not None:
+        query = query.where(or_(*(c.in_(user_ids) for c in export.user_columns)))
+        query = query.order_by(export.date_column, export.model.id)
+    else:
+        query = query.order_by(export.model.id)
+    if isinstance(export.date_column.type, DateTime):
+        # Timestamps run to the end of the last day
+        if start is not None:
+            query = query.where(export.date_column >= datetime.combine(start, time.min))
+        if end is not None:
+            query = query.where(export.date_column < datetime.combine(end + timedelta(days=1), time.min))
+    else:
+        if start is not None:
+            query = query.where(export.date_column >= start)
+        if end is not None:
+            query = query.where(export.date_column <= end)
+    return _partitions(query, chunk_size)
+
+
+def _partitions(query, chunk_size):
+    result = db.session.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
+    yield from result.partitions()
+
+
+# --- Writers: each takes the column names and row chunks and yields bytes ---
+def _plain(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def write_csv(names, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for chunk in chunks:
+        writer.writerows([_plain(v) for v in row] for row in chunk)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def write_ndjson(names, chunks):
+    for chunk in chunks:
+        yield "".join(
+            json.dumps(dict(zip(names, map(_plain, row))), ensure_ascii=False) + "\n" for row in chunk
+        ).encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only file object that hands out what was written since the last drain."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def drain(self):
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def write_parquet(names, chunks, columns):
+    """One Parquet row group per chunk, streamed as it is written (needs pyarrow)."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Parquet export needs pyarrow (pip install pyarrow).")
+    schema = pa.schema([(name, _arrow_type(pa, column)) for name, column in zip(names, columns)])
+    return _parquet_chunks(pa, pq, schema, chunks)
+
+
+def _parquet_chunks(pa, pq, schema, chunks):
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)], schema=schema
+            ))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def _arrow_type(pa, column):
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    if isinstance(column.type, Date):
+        return pa.date32()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    return pa.string()
+
+
+def stream_export(kind, fmt, user_ids=None, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """Yield the encoded export of `kind` in `fmt` ("csv", "ndjson" or "parquet") chunk by chunk."""
+    if kind not in EXPORTS:
+        raise ExportError(f"Unknown export {kind!r}; choose from {', '.join(EXPORTS)}.")
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format {fmt!r}; choose from {', '.join(FORMATS)}.")
+    export = EXPORTS[kind]
+    chunks = export_chunks(kind, user_ids, start, end, chunk_size)
+    if fmt == "csv":
+        return write_csv(export.names, chunks)
+    if fmt == "ndjson":
+        return write_ndjson(export.names, chunks)
+    return write_parquet(export.names, chunks, export.columns)
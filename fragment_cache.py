@@ -0,0 +1,143 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from cache_versions import get_version
+
+OFFSET_PROGRAMS_VERSION_KEY = "offset_programs"  # bumped whenever OffsetProgram rows change
+MAX_ENTRIES = 256
+PRUNE_EVERY = 64  # SQLite backend: writes between trims back to max_entries
+TOUCH_INTERVAL = 5.0  # SQLite backend: seconds between used_at updates of one key by one process
+
+
+# --- Backends: get(key) -> value or None, set(key, value) ---
+class LRUBackend:
+    """In-process LRU of rendered fragments (the default; one copy per worker)."""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """Fragments in a SQLite file, shared by every worker process on the host.
+
+    Values are stored as JSON. Each thread keeps its own connection; the
+    file runs in WAL mode so readers never wait for the occasional writer.
+    Pruning keeps the most recently used entries: hits refresh used_at, at
+    most once per TOUCH_INTERVAL per key and process, so reads stay cheap.
+    """
+
+    def __init__(self, path, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._touched = {}  # key -> time this process last refreshed its used_at
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS fragment (key TEXT PRIMARY KEY, value TEXT NOT NULL, used_at REAL NOT NULL)"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM fragment WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - self._touched.get(key, 0.0) >= TOUCH_INTERVAL:
+            if len(self._touched) > 4 * self.max_entries:
+                self._touched.clear()
+            self._touched[key] = now
+            conn.execute("UPDATE fragment SET used_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO fragment (key, value, used_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), now),
+        )
+        self._touched[key] = now
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            conn.execute(
+                "DELETE FROM fragment WHERE key NOT IN (SELECT key FROM fragment ORDER BY used_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        self._connect().execute("DELETE FROM fragment")
+
+
+# --- Cache ---
+class FragmentCache:
+    """Rendered fragments keyed by (name, generation).
+
+    Writers bump the generation stamp (a CacheVersion row) in the same
+    transaction as their change, so a new generation simply misses and
+    entries for old generations age out of the backend. Configure the
+    backend with FRAGMENT_CACHE_URL: empty for the in-process LRU, or
+    sqlite:///path/to/file.db for a cache shared across workers.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or LRUBackend()
+
+    def init_app(self, app):
+        url = app.config.get("FRAGMENT_CACHE_URL")
+        if url:
+            if not url.startswith("sqlite:///"):
+                raise ValueError(f"Unsupported FRAGMENT_CACHE_URL: {url}")
+            path = url[len("sqlite:///"):]
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.backend = SQLiteBackend(path)
+        else:
+            self.backend = LRUBackend()
+
+    def get_or_render(self, name, version_key, render):
+        """Return the fragment `name` for the current generation of `version_key`, rendering on a miss.
+
+        The generation is read before rendering, so a cached value is never
+        older than the generation it is stored under.
+        """
+        key = f"{name}:{get_version(version_key)}"
+        value = self.backend.get(key)
+        if value is None:
+            value = render()
+            self.backend.set(key, value)
+        return value
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,259 @@
+import csv
+import io
+import json
+import re
+from datetime import datetime
+from itertools import islice
+
+import numpy as np
+from sqlalchemy import insert, update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import db, User, Activity, EmissionRecord
+from emission_factors import factor_registry
+from rollup import add_emissions
+from cache_versions import next_data_version
+import analytics
+import ledger
+from ledger import leg
+
+# Rows per chunk when streaming uploaded files through the pipeline
+CHUNK_SIZE = 5000
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")  # YYYY-MM-DD, as the forms and uploads document
+
+
+class IngestError(ValueError):
+    pass
+
+
+class ActivityBatch:
+    """Column-oriented view of a validated set of activity rows."""
+
+    def __init__(self, activity_types, descriptions, amounts, units, dates):
+        self.activity_types = activity_types
+        self.descriptions = descriptions
+        self.amounts = amounts
+        self.units = units
+        self.dates = dates
+        self.emissions = None
+
+    def __len__(self):
+        return len(self.amounts)
+
+    @classmethod
+    def concat(cls, batches):
+        """One batch holding the rows of `batches` in order (emissions included if all are priced)."""
+        batch = cls(
+            np.concatenate([b.activity_types for b in batches]),
+            [d for b in batches for d in b.descriptions],
+            np.concatenate([b.amounts for b in batches]),
+            [u for b in batches for u in b.units],
+            np.concatenate([b.dates for b in batches]),
+        )
+        if all(b.emissions is not None for b in batches):
+            batch.emissions = np.concatenate([b.emissions for b in batches])
+        return batch
+
+    def rows(self):
+        """The batch as row dicts, the inverse of parse_rows."""
+        return [
+            {"activity_type": t, "description": d, "amount": a, "unit": u, "date": day.isoformat()}
+            for t, d, a, u, day in zip(self.activity_types.tolist(), self.descriptions,
+                                       self.amounts.tolist(), self.units, self.dates.astype(object))
+        ]
+
+
+def parse_rows(rows, first_row=1):
+    """Validate a list of row dicts and return an ActivityBatch (or None if all rows are blank).
+
+    Rows with an empty activity_type are skipped, like empty form rows.
+    `first_row` is the 1-based number of rows[0], used in error messages.
+    """
+    numbered = [
+        (first_row + i, r) for i, r in enumerate(rows)
+        if (r.get("activity_type") or "").strip()
+    ]
+    if not numbered:
+        return None
+    line_numbers = [n for n, _ in numbered]
+    rows = [r for _, r in numbered]
+
+    activity_types = np.array([r["activity_type"].strip() for r in rows], dtype=object)
+    units = [(r.get("unit") or "").strip() for r in rows]
+    descriptions = [r.get("description") for r in rows]
+
+    raw_amounts = [r.get("amount") for r in rows]
+    try:
+        amounts = np.array([_amount(a) for a in raw_amounts])
+    except (TypeError, ValueError):
+        amounts = None
+    if amounts is None or not np.isfinite(amounts).all():
+        bad = next((i for i, a in enumerate(raw_amounts) if not _is_number(a)), 0)
+        raise IngestError(f"Row {line_numbers[bad]}: invalid amount {raw_amounts[bad]!r}.")
+
+    missing_unit = next((i for i, u in enumerate(units) if not u), None)
+    if missing_unit is not None:
+        raise IngestError(f"Row {line_numbers[missing_unit]}: unit is required.")
+
+    raw_dates = [(r.get("date") or "").strip() for r in rows]
+    # numpy also takes "2024", "today" or 8-digit years, so check the exact format first
+    bad = next((i for i, d in enumerate(raw_dates) if d and not _is_date(d)), None)
+    if bad is not None:
+        raise IngestError(f"Row {line_numbers[bad]}: invalid date {raw_dates[bad]!r} (expected YYYY-MM-DD).")
+    dates = np.array(raw_dates, dtype="datetime64[D]")  # blank → NaT
+    dates[np.isnat(dates)] = np.datetime64(datetime.utcnow().date(), "D")
+
+    return ActivityBatch(activity_types, descriptions, amounts, units, dates)
+
+
+def compute_emissions(batch, factor_index=None):
+    """Fill batch.emissions (kg CO₂e), pricing each row with the factor in effect on its date."""
+    if factor_index is None:
+        factor_index = factor_registry.index()
+    batch.emissions = batch.amounts * factor_index.factors_at(batch.activity_types, batch.dates)
+    return batch.emissions
+
+
+def deduct_credits(credits, emissions):
+    """Apply emissions (kg) to a credit balance (t), clamping at zero after every row.
+
+    Equivalent to the sequential `credits -= e / 1000; credits = max(credits, 0)`
+    loop: the clamped walk ends at S_n - min(0, min_k S_k) for running balance S.
+    """
+    running = credits - np.cumsum(emissions / 1000)
+    floor = min(0.0, float(running.min())) if len(running) else 0.0
+    return float(running[-1]) - floor if len(running) else credits
+
+
+def write_batch(user, batch):
+    """Bulk insert Activity and EmissionRecord rows, update the daily rollup, the user's credits and the ledger. Caller commits."""
+    dates = batch.dates.astype(object)
+    emissions = batch.emissions.tolist()
+    db.session.execute(insert(Activity), [
+        {
+            "user_id": user.id,
+            "activity_type": t,
+            "description": d,
+            "amount": a,
+            "unit": u,
+            "date": day,
+        }
+        for t, d, a, u, day in zip(batch.activity_types.tolist(), batch.descriptions,
+                                   batch.amounts.tolist(), batch.units, dates)
+    ])
+    db.session.execute(insert(EmissionRecord), [
+        {"user_id": user.id, "date": day, "emission_value": e}
+        for day, e in zip(dates, emissions)
+    ])
+    add_emissions(user.id, batch.dates, batch.emissions)
+    analytics.add_activities(user.id, batch)
+
+    # Re-read the balance after the inserts above took the write lock, so a
+    # concurrent trade or offset can't be overwritten by a stale value.
+    before = db.session.query(User.credits).filter(User.id == user.id).with_for_update().scalar()
+    after = deduct_credits(before, batch.emissions)
+    db.session.execute(
+        update(User).where(User.id == user.id).values(credits=after, data_version=next_data_version(user.id))
+    )
+    set_committed_value(user, "credits", after)
+    change = after - before  # the zero clamp makes this differ from -sum(emissions)
+    ledger.post("emission", leg("credits", change, user.id), leg("emissions", -change))
+
+
+def ingest_rows(user, rows, first_row=1, factor_index=None):
+    """Parse, price and write one batch of rows. Returns (rows written, total kg CO₂e)."""
+    batch = parse_rows(rows, first_row)
+    if batch is None:
+        return 0, 0.0
+    compute_emissions(batch, factor_index)
+    write_batch(user, batch)
+    return len(batch), float(batch.emissions.sum())
+
+
+def ingest_stream(user, rows, chunk_size=CHUNK_SIZE):
+    """Run an iterable of row dicts through the pipeline chunk by chunk.
+
+    Everything lands in the caller's transaction, so a bad row rolls back
+    the whole upload once the caller handles the IngestError.
+    """
+    factor_index = factor_registry.index()
+    rows = iter(rows)
+    count, total, first_row = 0, 0.0, 1
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        written, emission = ingest_rows(user, chunk, first_row, factor_index)
+        count += written
+        total += emission
+        first_row += len(chunk)
+    return count, total
+
+
+def form_rows(form):
+    """Turn the activity_entry form's parallel lists into row dicts."""
+    return [
+        {"activity_type": t, "description": d, "amount": a, "unit": u, "date": day}
+        for t, d, a, u, day in zip(
+            form.getlist("activity_type[]"), form.getlist("description[]"),
+            form.getlist("amount[]"), form.getlist("unit[]"), form.getlist("date[]"),
+        )
+    ]
+
+
+def read_upload(file):
+    """Yield row dicts from an uploaded .csv, .json (array) or .ndjson/.jsonl file."""
+    name = (file.filename or "").lower()
+    if name.endswith(".csv"):
+        yield from csv.DictReader(io.TextIOWrapper(file.stream, encoding="utf-8-sig"))
+    elif name.endswith((".ndjson", ".jsonl")):
+        for line in io.TextIOWrapper(file.stream, encoding="utf-8"):
+            if line.strip():
+                yield _json_row(line)
+    elif name.endswith(".json"):
+        try:
+            data = json.load(file.stream)
+        except json.JSONDecodeError as e:
+            raise IngestError(f"Invalid JSON file: {e.msg}.")
+        if not isinstance(data, list):
+            raise IngestError("JSON upload must be an array of activity objects.")
+        yield from (_as_row(r) for r in data)
+    else:
+        raise IngestError("Unsupported file type. Upload a .csv, .json or .ndjson file.")
+
+
+def _json_row(line):
+    try:
+        return _as_row(json.loads(line))
+    except json.JSONDecodeError as e:
+        raise IngestError(f"Invalid JSON line: {e.msg}.")
+
+
+def _as_row(obj):
+    if not isinstance(obj, dict):
+        raise IngestError("Each activity must be a JSON object.")
+    return {k: (v if v is None or isinstance(v, str) else str(v)) for k, v in obj.items()}
+
+
+def _amount(value):
+    """float() of one amount, minus the digit separators ("1_000") it would also accept."""
+    if isinstance(value, str) and "_" in value:
+        raise ValueError(value)
+    return float(value)
+
+
+def _is_number(value):
+    try:
+        return np.isfinite(_amount(value))
+    except (TypeError, ValueError):
+        return False
+
+
+def _is_date(value):
+    if not _DATE.fullmatch(value):
+        return False
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,228 @@
+import hmac
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, abort, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+
+from models import db
+
+SAMPLE_RATE = 0.1          # fraction of requests instrumented
+N_PLUS_ONE_THRESHOLD = 10  # same statement this many times in one request is reported as N+1
+STATEMENT_LABEL_LENGTH = 160
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+LOOPBACK = ("127.0.0.1", "::1")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+class RequestStats:
+    """What one sampled request did: its queries, their time, and template render time."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.slowest = (0.0, None)
+        self.statements = Counter()
+        self._query_started = None
+        self._render_started = []
+
+
+class Metrics:
+    """Per-route request metrics for a sample of requests, exposed in Prometheus text format.
+
+    Sampled requests are timed end to end; SQLAlchemy engine events count
+    their statements and DB time and Flask's template signals their render
+    time. A statement repeated N_PLUS_ONE_THRESHOLD times in one request
+    is counted (and logged once) as an N+1 pattern. Unsampled requests pay
+    for one random() call and a few attribute checks. Metrics are kept per
+    process, so each worker exposes its own series.
+
+    /metrics reveals SQL fingerprints and per-route timings, so it is only
+    mounted when METRICS_ENDPOINT is set, and then answers a request that
+    carries "Authorization: Bearer <METRICS_TOKEN>" or, with no token
+    configured, one from the loopback interface.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.sample_rate = SAMPLE_RATE
+        self.token = None
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(dict)   # metric -> {(route, method): Histogram}
+        self._n_plus_one = Counter()            # (route, statement) -> requests
+        self._slowest = {}                      # route -> (seconds, statement)
+
+    def init_app(self, app):
+        self.app = app
+        self.sample_rate = app.config.get("METRICS_SAMPLE_RATE", SAMPLE_RATE)
+        self.token = app.config.get("METRICS_TOKEN") or None
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        with app.app_context():
+            event.listen(db.engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(db.engine, "after_cursor_execute", self._after_cursor_execute)
+        if app.config.get("METRICS_ENDPOINT", False):
+            app.add_url_rule("/metrics", "metrics", self.view)
+
+    # --- Hooks ---
+    @staticmethod
+    def _current():
+        return g.get("_request_stats") if has_request_context() else None
+
+    def _before_request(self):
+        if request.endpoint != "metrics" and random.random() < self.sample_rate:
+            g._request_stats = RequestStats()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._current()
+        if stats is not None:
+            stats._query_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._current()
+        if stats is None or stats._query_started is None:
+            return
+        elapsed = time.perf_counter() - stats._query_started
+        stats._query_started = None
+        stats.queries += 1
+        stats.db_time += elapsed
+        stats.statements[statement] += 1
+        if elapsed > stats.slowest[0]:
+            stats.slowest = (elapsed, statement)
+
+    def _before_render(self, app, template, context, **extra):
+        stats = self._current()
+        if stats is not None:
+            stats._render_started.append(time.perf_counter())
+
+    def _after_render(self, app, template, context, **extra):
+        stats = self._current()
+        if stats is not None and stats._render_started:
+            started = stats._render_started.pop()
+            if not stats._render_started:  # nested renders are already inside the outer one
+                stats.render_time += time.perf_counter() - started
+
+    def _teardown_request(self, exc):
+        stats = g.pop("_request_stats", None)
+        if stats is not None:
+            self.record(request.url_rule.rule if request.url_rule else "unmatched", request.method, stats)
+
+    # --- Aggregation ---
+    def record(self, route, method, stats):
+        duration = time.perf_counter() - stats.started
+        repeated = [s for s, n in stats.statements.items() if n >= N_PLUS_ONE_THRESHOLD]
+        with self._lock:
+            key = (route, method)
+            for metric, value, buckets in (
+                ("request_duration_seconds", duration, SECONDS_BUCKETS),
+                ("request_db_seconds", stats.db_time, SECONDS_BUCKETS),
+                ("request_render_seconds", stats.render_time, SECONDS_BUCKETS),
+                ("request_queries", stats.queries, QUERY_BUCKETS),
+            ):
+                histogram = self._histograms[metric].get(key)
+                if histogram is None:
+                    histogram = self._histograms[metric][key] = Histogram(buckets)
+                histogram.observe(value)
+            if stats.slowest[1] is not None and stats.slowest[0] > self._slowest.get(route, (0.0,))[0]:
+                self._slowest[route] = (stats.slowest[0], _fingerprint(stats.slowest[1]))
+            new_patterns = []
+            for statement in repeated:
+                pattern = (route, _fingerprint(statement))
+                if not self._n_plus_one[pattern]:
+                    new_patterns.append((pattern[1], stats.statements[statement]))
+                self._n_plus_one[pattern] += 1
+        for statement, count in new_patterns:
+            self.app.logger.warning("N+1 query on %s: %d× %s", route, count, statement)
+
+    # --- Exposition ---
+    def render(self):
+        lines = [
+            "# HELP carbon_metrics_sample_rate Fraction of requests instrumented.",
+            "# TYPE carbon_metrics_sample_rate gauge",
+            f"carbon_metrics_sample_rate {self.sample_rate}",
+        ]
+        with self._lock:
+            for metric, help_text in (
+                ("request_duration_seconds", "Request wall time of sampled requests."),
+                ("request_db_seconds", "Time spent executing SQL per sampled request."),
+                ("request_render_seconds", "Template render time per sampled request."),
+                ("request_queries", "SQL statements per sampled request."),
+            ):
+                name = f"carbon_{metric}"
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for (route, method), h in sorted(self._histograms[metric].items()):
+                    labels = f'route="{_escape(route)}",method="{method}"'
+                    cumulative = 0
+                    for bound, count in zip(h.buckets, h.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {h.count}')
+                    lines.append(f"{name}_sum{{{labels}}} {h.sum:.6f}")
+                    lines.append(f"{name}_count{{{labels}}} {h.count}")
+            lines += ["# HELP carbon_n_plus_one_total Sampled requests that repeated a statement "
+                      f"{N_PLUS_ONE_THRESHOLD}+ times.",
+                      "# TYPE carbon_n_plus_one_total counter"]
+            for (route, statement), count in sorted(self._n_plus_one.items()):
+                labels = f'route="{_escape(route)}",statement="{_escape(statement)}"'
+                lines.append(f"carbon_n_plus_one_total{{{labels}}} {count}")
+            lines += ["# HELP carbon_slowest_statement_seconds Slowest statement seen per route.",
+                      "# TYPE carbon_slowest_statement_seconds gauge"]
+            for route, (seconds, statement) in sorted(self._slowest.items()):
+                labels = f'route="{_escape(route)}",statement="{_escape(statement)}"'
+                lines.append(f"carbon_slowest_statement_seconds{{{labels}}} {seconds:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def view(self):
+        if self.token is not None:
+            supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+            if not hmac.compare_digest(supplied.encode(), self.token.encode()):
+                abort(401)
+        elif request.remote_addr not in LOOPBACK:
+            abort(404)
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._n_plus_one.clear()
+            self._slowest.clear()
+
+
+_WHITESPACE = re.compile(r"\s+")
+_IN_LIST = re.compile(r"\((?:\?|%\(\w+\)s)(?:, (?:\?|%\(\w+\)s))*\)")
+
+
+def _fingerprint(statement):
+    """Statement text with whitespace collapsed and IN lists folded, cut to a label-sized length."""
+    text = _IN_LIST.sub("(…)", _WHITESPACE.sub(" ", statement).strip())
+    return text[:STATEMENT_LABEL_LENGTH]
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+metrics = Metrics()
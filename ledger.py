@@ -0,0 +1,228 @@
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from itertools import groupby
+
+from sqlalchemy import and_, func, insert, select
+
+from models import db, User, LedgerEntry, BalanceSnapshot, MarketplaceListing
+
+EPSILON = 1e-6
+
+# account -> asset. User-owned accounts carry a user_id; the rest are system accounts.
+ACCOUNTS = {
+    "credits": "tCO2e", "escrow": "tCO2e", "emissions": "tCO2e",
+    "offsets": "tCO2e", "credit_issuance": "tCO2e",
+    "wallet": "INR", "cash_issuance": "INR",
+}
+USER_ACCOUNTS = {"credits": "credits", "wallet": "wallet_balance"}  # account -> User column
+
+
+class UnbalancedJournal(ValueError):
+    pass
+
+
+# --- Posting ---
+def leg(account, amount, user_id=None):
+    return (user_id, account, amount)
+
+def post(kind, *legs, created_at=None):
+    """Append one journal. Legs must sum to zero per asset. Caller commits."""
+    legs = [l for l in legs if abs(l[2]) > 0]
+    if not legs:
+        return None
+    totals = defaultdict(float)
+    for _, account, amount in legs:
+        totals[ACCOUNTS[account]] += amount
+    if any(abs(t) > EPSILON for t in totals.values()):
+        raise UnbalancedJournal(f"{kind}: {dict(totals)}")
+    journal_id = uuid.uuid4().hex
+    created_at = created_at or datetime.utcnow()
+    db.session.execute(insert(LedgerEntry), [
+        {"journal_id": journal_id, "kind": kind, "user_id": user_id, "account": account,
+         "asset": ACCOUNTS[account], "amount": amount, "created_at": created_at}
+        for user_id, account, amount in legs
+    ])
+    return journal_id
+
+def open_account(user_id, credits, wallet_balance):
+    post("opening",
+         leg("credits", credits, user_id), leg("credit_issuance", -credits),
+         leg("wallet", wallet_balance, user_id), leg("cash_issuance", -wallet_balance))
+
+
+# --- Historical balances ---
+def balance_at(user_id, timestamp, account="credits"):
+    """Balance of a user account as of `timestamp`: latest snapshot plus the ledger tail after it."""
+    snapshot = (
+        BalanceSnapshot.query
+        .filter_by(user_id=user_id, account=account)
+        .filter(BalanceSnapshot.created_at <= timestamp)
+        .order_by(BalanceSnapshot.as_of_entry_id.desc())
+        .first()
+    )
+    base, after_id = (snapshot.balance, snapshot.as_of_entry_id) if snapshot else (0.0, 0)
+    tail = (
+        db.session.query(func.sum(LedgerEntry.amount))
+        .filter(
+            LedgerEntry.user_id == user_id, LedgerEntry.account == account,
+            LedgerEntry.id > after_id, LedgerEntry.created_at <= timestamp,
+        )
+        .scalar()
+    )
+    return base + (tail or 0.0)
+
+
+# --- Snapshots ---
+def take_snapshots():
+    """Write a snapshot for every user account with entries since its last snapshot. Caller commits.
+
+    Each snapshot is the previous snapshot plus one grouped SUM over the
+    tail, so a run only reads entries appended since the last run.
+    Returns the number of snapshots written.
+    """
+    latest = (
+        db.session.query(
+            BalanceSnapshot.user_id, BalanceSnapshot.account,
+            func.max(BalanceSnapshot.as_of_entry_id).label("as_of"),
+        )
+        .group_by(BalanceSnapshot.user_id, BalanceSnapshot.account)
+        .subquery()
+    )
+    previous = {
+        (s.user_id, s.account): s.balance
+        for s in BalanceSnapshot.query.join(latest, and_(
+            latest.c.user_id == BalanceSnapshot.user_id,
+            latest.c.account == BalanceSnapshot.account,
+            latest.c.as_of == BalanceSnapshot.as_of_entry_id,
+        ))
+    }
+    tails = (
+        db.session.query(
+            LedgerEntry.user_id, LedgerEntry.account,
+            func.max(LedgerEntry.id), func.sum(LedgerEntry.amount),
+        )
+        .outerjoin(latest, and_(latest.c.user_id == LedgerEntry.user_id, latest.c.account == LedgerEntry.account))
+        .filter(LedgerEntry.user_id.isnot(None), LedgerEntry.id > func.coalesce(latest.c.as_of, 0))
+        .group_by(LedgerEntry.user_id, LedgerEntry.account)
+        .all()
+    )
+    if not tails:
+        return 0
+    stamps = dict(
+        db.session.query(LedgerEntry.id, LedgerEntry.created_at)
+        .filter(LedgerEntry.id.in_([last_id for _, _, last_id, _ in tails]))
+    )
+    db.session.execute(insert(BalanceSnapshot), [
+        {"user_id": user_id, "account": account, "as_of_entry_id": last_id,
+         "balance": previous.get((user_id, account), 0.0) + amount, "created_at": stamps[last_id]}
+        for user_id, account, last_id, amount in tails
+    ])
+    return len(tails)
+
+
+# --- Reconciliation ---
+def reconcile(chunk_size=10000):
+    """Verify the ledger in one streaming pass. Returns a list of problem descriptions.
+
+    Checks that every journal balances per asset, that each snapshot equals
+    the running sum of its account's entries, that user accounts match the
+    User balance columns, and that the escrow account matches open listings.
+    """
+    problems = []
+
+    unbalanced = (
+        db.session.query(LedgerEntry.journal_id, LedgerEntry.asset, func.sum(LedgerEntry.amount))
+        .group_by(LedgerEntry.journal_id, LedgerEntry.asset)
+        .having(func.abs(func.sum(LedgerEntry.amount)) > EPSILON)
+    )
+    for journal_id, asset, total in unbalanced.yield_per(chunk_size):
+        problems.append(f"journal {journal_id} does not balance: {total:+.6f} {asset}")
+
+    entries = (
+        db.session.query(LedgerEntry.user_id, LedgerEntry.account, LedgerEntry.id, LedgerEntry.amount)
+        .filter(LedgerEntry.user_id.isnot(None))
+        .order_by(LedgerEntry.user_id, LedgerEntry.account, LedgerEntry.id)
+        .yield_per(chunk_size)
+    )
+    snapshots = iter(
+        db.session.query(BalanceSnapshot.user_id, BalanceSnapshot.account,
+                         BalanceSnapshot.as_of_entry_id, BalanceSnapshot.balance)
+        .order_by(BalanceSnapshot.user_id, BalanceSnapshot.account, BalanceSnapshot.as_of_entry_id)
+        .yield_per(chunk_size)
+    )
+    snapshot = next(snapshots, None)
+    balances = {}
+    for (user_id, account), rows in groupby(entries, key=lambda e: (e.user_id, e.account)):
+        running = 0.0
+        for row in rows:
+            # Snapshots of accounts with no entries sort before this group
+            while snapshot and (snapshot.user_id, snapshot.account) < (user_id, account):
+                problems.append(f"snapshot for user {snapshot.user_id} {snapshot.account} has no entries")
+                snapshot = next(snapshots, None)
+            running += row.amount
+            while snapshot and (snapshot.user_id, snapshot.account, snapshot.as_of_entry_id) == (user_id, account, row.id):
+                if abs(snapshot.balance - running) > EPSILON:
+                    problems.append(f"snapshot for user {user_id} {account} at entry {row.id}: "
+                                    f"{snapshot.balance:.6f} != ledger {running:.6f}")
+                snapshot = next(snapshots, None)
+        balances[(user_id, account)] = running
+    for snapshot in ([snapshot] if snapshot else []) + list(snapshots):
+        problems.append(f"snapshot for user {snapshot.user_id} {snapshot.account} "
+                        f"at entry {snapshot.as_of_entry_id} has no matching entry")
+
+    for user in db.session.query(User.id, User.credits, User.wallet_balance).yield_per(chunk_size):
+        for account, column in USER_ACCOUNTS.items():
+            expected = getattr(user, column) or 0.0
+            actual = balances.get((user.id, account), 0.0)
+            if abs(actual - expected) > EPSILON:
+                problems.append(f"user {user.id} {account}: ledger {actual:.6f} != balance {expected:.6f}")
+
+    escrow = db.session.query(func.sum(LedgerEntry.amount)).filter(LedgerEntry.account == "escrow").scalar() or 0.0
+    listed = (
+        db.session.query(func.sum(MarketplaceListing.credits))
+        .filter(MarketplaceListing.status == "available").scalar() or 0.0
+    )
+    if abs(escrow - listed) > EPSILON:
+        problems.append(f"escrow account {escrow:.6f} != open listings {listed:.6f}")
+    return problems
+
+
+# --- Backfill for databases that predate the ledger ---
+def backfill():
+    """Post opening journals for user accounts and escrow that have none yet. Caller commits.
+
+    Each opening is the User column minus what the ledger already holds for
+    that account, so activity or trades posted between `upgrade-db` and the
+    backfill still reconcile. Accounts that already have an opening journal
+    are left alone, so later drift keeps showing up in reconcile().
+    Returns the number of users given an opening journal.
+    """
+    openings = defaultdict(list)
+    for account, column in USER_ACCOUNTS.items():
+        opened = select(LedgerEntry.user_id).where(
+            LedgerEntry.kind == "opening", LedgerEntry.account == account, LedgerEntry.user_id.isnot(None))
+        rows = (
+            db.session.query(User.id, getattr(User, column), func.coalesce(func.sum(LedgerEntry.amount), 0.0))
+            .outerjoin(LedgerEntry, and_(LedgerEntry.user_id == User.id, LedgerEntry.account == account))
+            .filter(User.id.notin_(opened))
+            .group_by(User.id)
+        )
+        issuance = "credit_issuance" if ACCOUNTS[account] == "tCO2e" else "cash_issuance"
+        for user_id, balance, posted in rows:
+            missing = (balance or 0.0) - posted
+            if abs(missing) > EPSILON:
+                openings[user_id] += [leg(account, missing, user_id), leg(issuance, -missing)]
+    for user_id, legs in openings.items():
+        post("opening", *legs)
+
+    has_opening = db.session.query(LedgerEntry.id).filter_by(kind="opening", user_id=None, account="escrow").first()
+    if has_opening is None:
+        escrow = db.session.query(func.sum(LedgerEntry.amount)).filter(LedgerEntry.account == "escrow").scalar() or 0.0
+        listed = (
+            db.session.query(func.sum(MarketplaceListing.credits))
+            .filter(MarketplaceListing.status == "available").scalar() or 0.0
+        )
+        if abs(listed - escrow) > EPSILON:
+            post("opening", leg("escrow", listed - escrow), leg("credit_issuance", escrow - listed))
+    return len(openings)
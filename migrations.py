@@ -0,0 +1,32 @@
+from sqlalchemy import inspect
+
+from models import db
+
+
+def upgrade():
+    """Bring an existing database up to the current models.py schema.
+
+    Creates tables added since the database was made, adds missing
+    nullable columns (ALTER TABLE ... ADD COLUMN) and missing indexes.
+    Safe to run repeatedly. Returns the names of the columns and indexes
+    that were created.
+    """
+    db.create_all()
+    bind = db.engine
+    created = []
+    with bind.begin() as conn:
+        existing = inspect(conn)
+        for table in db.metadata.sorted_tables:
+            columns = {c["name"] for c in existing.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns and column.nullable:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    conn.exec_driver_sql(
+                        f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                    )
+                    created.append(f"{table.name}.{column.name}")
+            for index in table.indexes:
+                if not bind.dialect.has_index(conn, table.name, index.name):
+                    index.create(conn)
+                    created.append(index.name)
+    return created
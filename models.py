@@ -11,6 +11,7 @@ class User(db.Model, UserMixin):
     password = db.Column(db.String(200), nullable=False)
     credits = db.Column(db.Float, default=5.0)           # in tCO₂e
     wallet_balance = db.Column(db.Float, default=5000.0) # in ₹ (INR)
+    data_version = db.Column(db.Integer, default=0)      # bumped by every write to the user's data
 
 
     activities = db.relationship("Activity", backref="user", lazy=True)
@@ -23,7 +24,22 @@ class EmissionFactor(db.Model):
     activity_type = db.Column(db.String(100), unique=True, nullable=False)
     factor = db.Column(db.Float, nullable=False)  # kg CO₂ per unit
 
+class EmissionFactorVersion(db.Model):
+    # A factor revision, in effect from valid_from until the type's next revision
+    __table_args__ = (
+        db.UniqueConstraint("activity_type", "valid_from", name="uq_factor_version_type_from"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    activity_type = db.Column(db.String(100), nullable=False)
+    valid_from = db.Column(db.Date, nullable=False)
+    factor = db.Column(db.Float, nullable=False)  # kg CO₂ per unit
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Activity(db.Model):
+    __table_args__ = (
+        db.Index("ix_activity_user_date", "user_id", "date"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     activity_type = db.Column(db.String(100), nullable=False)
@@ -37,21 +53,40 @@ class Activity(db.Model):
     
     
 class EmissionRecord(db.Model):
+    __table_args__ = (
+        db.Index("ix_emission_record_user_date", "user_id", "date"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     date = db.Column(db.Date)
     emission_value = db.Column(db.Float)
 
 class MarketplaceListing(db.Model):
+    __table_args__ = (
+        db.Index("ix_listing_status_user", "status", "user_id"),
+        db.Index("ix_listing_user_status", "user_id", "status"),
+        db.Index("ix_listing_status_price", "status", "price_per_credit", "created_at"),
+        db.Index("ix_listing_revision", "revision"),
+        db.Index("ix_listing_status_expires", "status", "expires_at"),  # due-listing sweeps
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     credits = db.Column(db.Float, nullable=False)
     price_per_credit = db.Column(db.Float, nullable=False)
     total_price = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(20), default="available")  # available / sold
+    status = db.Column(db.String(20), default="available")  # available / sold / cancelled / expired
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    revision = db.Column(db.Integer, nullable=True)  # order-book version of the last change
+    expires_at = db.Column(db.DateTime, nullable=True)  # UTC; withdrawn by the expiry sweep after this
 
 class Transaction(db.Model):
+    __table_args__ = (
+        db.Index("ix_transaction_buyer_created", "buyer_id", "created_at"),
+        db.Index("ix_transaction_seller_created", "seller_id", "created_at"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     buyer_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     seller_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
@@ -72,6 +107,11 @@ class OffsetProgram(db.Model):
 
 
 class OffsetTransaction(db.Model):
+    __table_args__ = (
+        db.Index("ix_offset_transaction_user_created", "user_id", "created_at"),
+        db.Index("ix_offset_transaction_program", "program_id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     program_id = db.Column(db.Integer, db.ForeignKey("offset_program.id"), nullable=False)
@@ -81,3 +121,80 @@ class OffsetTransaction(db.Model):
 
     program = db.relationship("OffsetProgram", backref="transactions")
 
+
+class CacheVersion(db.Model):
+    name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class DailyEmission(db.Model):
+    # Per-user per-day rollup of EmissionRecord, maintained by rollup.py
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    emission_value = db.Column(db.Float, nullable=False, default=0.0)
+
+class LedgerEntry(db.Model):
+    # Append-only double-entry ledger; each journal's amounts sum to zero per asset
+    __table_args__ = (
+        db.Index("ix_ledger_account_id", "user_id", "account", "id"),
+        db.Index("ix_ledger_journal", "journal_id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    journal_id = db.Column(db.String(32), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)        # opening / emission / escrow / trade / offset / refund
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)  # NULL for system accounts
+    account = db.Column(db.String(30), nullable=False)     # credits / wallet / escrow / emissions / ...
+    asset = db.Column(db.String(10), nullable=False)       # tCO2e / INR
+    amount = db.Column(db.Float, nullable=False)           # signed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BalanceSnapshot(db.Model):
+    __table_args__ = (
+        db.Index("ix_snapshot_account_entry", "user_id", "account", "as_of_entry_id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    account = db.Column(db.String(30), nullable=False)
+    as_of_entry_id = db.Column(db.Integer, nullable=False)  # balance includes entries up to this id
+    balance = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)      # created_at of the as-of entry
+
+# --- Tenant-wide aggregates, maintained by analytics.py alongside the writes ---
+class UserTypeMonth(db.Model):
+    # Per-user emissions by activity type and calendar month (month = first day)
+    __table_args__ = (
+        db.Index("ix_user_type_month_type", "activity_type", "month", "user_id"),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    activity_type = db.Column(db.String(100), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    emission_value = db.Column(db.Float, nullable=False, default=0.0)  # kg CO₂e
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+    activity_count = db.Column(db.Integer, nullable=False, default=0)
+
+class TypeMonth(db.Model):
+    # UserTypeMonth summed over every user
+    activity_type = db.Column(db.String(100), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    emission_value = db.Column(db.Float, nullable=False, default=0.0)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+    activity_count = db.Column(db.Integer, nullable=False, default=0)
+
+class ProgramOffsetTotal(db.Model):
+    program_id = db.Column(db.Integer, db.ForeignKey("offset_program.id"), primary_key=True)
+    co2_offset = db.Column(db.Float, nullable=False, default=0.0)
+    credits_used = db.Column(db.Float, nullable=False, default=0.0)
+    offset_count = db.Column(db.Integer, nullable=False, default=0)
+
+class PriceDaily(db.Model):
+    # Marketplace price per credit per UTC day: open/high/low/close and volume
+    date = db.Column(db.Date, primary_key=True)
+    open = db.Column(db.Float, nullable=False)
+    high = db.Column(db.Float, nullable=False)
+    low = db.Column(db.Float, nullable=False)
+    close = db.Column(db.Float, nullable=False)
+    credits = db.Column(db.Float, nullable=False, default=0.0)
+    value = db.Column(db.Float, nullable=False, default=0.0)   # ₹ traded
+    trade_count = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,134 @@
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime
+
+from models import db, MarketplaceListing
+from cache_versions import get_version
+
+ORDER_BOOK_VERSION_KEY = "order_book"
+EPSILON = 1e-9  # credits below this are treated as zero
+MAX_ATTEMPTS = 3
+
+
+class Fill:
+    def __init__(self, listing_id, seller_id, credits, price):
+        self.listing_id = listing_id
+        self.seller_id = seller_id
+        self.credits = credits
+        self.price = price
+
+    @property
+    def amount(self):
+        return self.credits * self.price
+
+
+class OrderBook:
+    """In-memory price-time index of the available MarketplaceListing asks.
+
+    Asks are kept as a sorted list of (price, created_at, id) keys. The book
+    is loaded from the database on first use and then kept current by
+    pulling only listings whose `revision` is newer than the last version
+    seen, so every worker follows trades made by the others.
+    """
+
+    def __init__(self):
+        self._keys = []      # sorted (price_per_credit, created_at, id)
+        self._asks = {}      # id -> (key, seller_id, credits)
+        self._version = None
+        self._lock = threading.Lock()
+
+    # --- Synchronisation with the database ---
+    def sync(self):
+        version = get_version(ORDER_BOOK_VERSION_KEY)
+        if version == self._version:
+            return
+        with self._lock:
+            if self._version is None:
+                self._load(version)
+            elif version != self._version:
+                changed = MarketplaceListing.query.filter(MarketplaceListing.revision > self._version).all()
+                for listing in changed:
+                    self._discard(listing.id)
+                    if listing.status == "available":
+                        self._insert(listing)
+                self._version = version
+
+    def _load(self, version):
+        self._keys, self._asks = [], {}
+        rows = db.session.query(
+            MarketplaceListing.id, MarketplaceListing.user_id, MarketplaceListing.credits,
+            MarketplaceListing.price_per_credit, MarketplaceListing.created_at,
+        ).filter(MarketplaceListing.status == "available").all()
+        for row in rows:
+            key = (row.price_per_credit, row.created_at or datetime.min, row.id)
+            self._asks[row.id] = (key, row.user_id, row.credits)
+            self._keys.append(key)
+        self._keys.sort()
+        self._version = version
+
+    def _insert(self, listing):
+        key = (listing.price_per_credit, listing.created_at or datetime.min, listing.id)
+        self._asks[listing.id] = (key, listing.user_id, listing.credits)
+        insort(self._keys, key)
+
+    def _discard(self, listing_id):
+        entry = self._asks.pop(listing_id, None)
+        if entry:
+            i = bisect_left(self._keys, entry[0])
+            if i < len(self._keys) and self._keys[i] == entry[0]:
+                del self._keys[i]
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    # --- Matching ---
+    def __len__(self):
+        return len(self._keys)
+
+    def match(self, credits, max_price, budget=float("inf"), exclude_user=None):
+        """Walk the asks in price-time order and return the Fills for a buy order.
+
+        Fills up to `credits` at prices <= `max_price` without spending more
+        than `budget`; the last fill may take only part of a listing.
+        """
+        fills = []
+        remaining = credits
+        with self._lock:
+            for key in self._keys:
+                price, _, listing_id = key
+                if price > max_price or remaining <= EPSILON or budget <= EPSILON:
+                    break
+                _, seller_id, available = self._asks[listing_id]
+                if seller_id == exclude_user:
+                    continue
+                quantity = min(remaining, available, budget / price if price > 0 else available)
+                if quantity <= EPSILON:
+                    break
+                fills.append(Fill(listing_id, seller_id, quantity, price))
+                remaining -= quantity
+                budget -= quantity * price
+        return fills
+
+    def buy(self, buyer, credits, max_price):
+        """Match and settle a buy order for `buyer` in one committed transaction.
+
+        Returns the Fills. If another worker took a matched listing first,
+        the book is resynced and the order re-matched, up to MAX_ATTEMPTS.
+        Raises settlement.InsufficientFunds if the wallet changed under us.
+        """
+        from settlement import settle_fills, ListingUnavailable
+
+        for _ in range(MAX_ATTEMPTS):
+            self.sync()
+            fills = self.match(credits, max_price, buyer.wallet_balance, exclude_user=buyer.id)
+            if not fills:
+                return fills
+            try:
+                return settle_fills(buyer.id, fills)
+            except ListingUnavailable:
+                self.invalidate()
+        return []
+
+
+order_book = OrderBook()
@@ -0,0 +1,47 @@
+from datetime import date, datetime
+
+from sqlalchemy import and_, or_
+
+PAGE_SIZE = 50
+SEPARATOR = "~"
+
+
+# Cursors are plain "value~id[~extra]" strings passed back in the query string
+def encode_cursor(*parts):
+    return SEPARATOR.join(p.isoformat() if isinstance(p, (date, datetime)) else repr(p) if isinstance(p, float) else str(p)
+                          for p in parts)
+
+def decode_cursor(cursor, *types):
+    """Parse a cursor into a tuple using `types` (date, datetime, int, float). Bad cursors → None."""
+    if not cursor:
+        return None
+    parts = cursor.split(SEPARATOR)
+    if len(parts) != len(types):
+        return None
+    try:
+        return tuple(_parse(p, t) for p, t in zip(parts, types))
+    except ValueError:
+        return None
+
+def _parse(value, kind):
+    if kind is date:
+        return date.fromisoformat(value)
+    if kind is datetime:
+        return datetime.fromisoformat(value)
+    return kind(value)
+
+
+def keyset_page(query, sort_column, id_column, after=None, page_size=PAGE_SIZE):
+    """Newest-first page of `query` strictly after the (sort_value, id) key `after`.
+
+    Returns (rows, has_more). The expanded OR form keeps the (owner, sort_column)
+    indexes usable on both SQLite and Postgres.
+    """
+    if after is not None:
+        value, row_id = after
+        query = query.filter(or_(
+            sort_column < value,
+            and_(sort_column == value, id_column < row_id),
+        ))
+    rows = query.order_by(sort_column.desc(), id_column.desc()).limit(page_size + 1).all()
+    return rows[:page_size], len(rows) > page_size
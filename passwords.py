@@ -0,0 +1,87 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import update
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from models import db, User
+from cache_versions import touch_users
+
+HASH_METHOD = "scrypt:32768:8:1"  # Werkzeug's default; e.g. "pbkdf2:sha256:600000" or a cheaper scrypt n
+PENDING_PER_WORKER = 8            # queued hashes per worker before new ones are turned away
+SUBMIT_TIMEOUT = 2.0              # seconds a request waits for a queue slot before HasherBusy
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Password hashing on a bounded pool of worker threads.
+
+    hashlib's scrypt and PBKDF2 release the GIL, so PASSWORD_HASH_WORKERS
+    threads (default: one per core) hash in parallel while the request
+    threads that asked wait on the result. At most PENDING_PER_WORKER
+    hashes per worker are queued; beyond that callers get HasherBusy
+    instead of piling up behind a login storm. Hashes are stored with
+    their parameters, so verify() accepts every past PASSWORD_HASH_METHOD
+    and needs_rehash() spots the ones to upgrade on the next login.
+    """
+
+    def __init__(self):
+        self.method = HASH_METHOD
+        self.workers = os.cpu_count() or 1
+        self.max_pending = self.workers * PENDING_PER_WORKER
+        self._normalized = None
+        self._executor = None
+        self._pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.method = app.config.get("PASSWORD_HASH_METHOD") or HASH_METHOD
+        self.workers = app.config.get("PASSWORD_HASH_WORKERS") or os.cpu_count() or 1
+        self.max_pending = app.config.get("PASSWORD_HASH_MAX_PENDING") or self.workers * PENDING_PER_WORKER
+        self._normalized = None
+        self._executor = None
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, stored, password):
+        return self._run(check_password_hash, stored, password)
+
+    def needs_rehash(self, stored):
+        """True if `stored` was hashed with other parameters than PASSWORD_HASH_METHOD."""
+        if self._normalized is None:
+            # Werkzeug fills in defaults ("scrypt" -> "scrypt:32768:8:1"); learn the full form once
+            self._normalized = generate_password_hash("", self.method).split("$", 1)[0]
+        return stored.split("$", 1)[0] != self._normalized
+
+    def _run(self, fn, *args):
+        with self._lock:
+            # Created lazily so forked workers each get their own threads
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="password-hash")
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+                self._pid = os.getpid()
+            executor, slots = self._executor, self._slots
+        if not slots.acquire(timeout=SUBMIT_TIMEOUT):
+            raise HasherBusy(f"{self.max_pending} password hashes queued")
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future.result()
+
+
+def set_password(user_id, password_hash):
+    """Store a new hash for the user; the cached identity is dropped when the transaction commits."""
+    db.session.execute(update(User).where(User.id == user_id).values(password=password_hash))
+    touch_users([user_id])
+
+
+password_hasher = PasswordHasher()
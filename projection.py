@@ -0,0 +1,229 @@
+import json
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import func
+
+from models import db, Activity
+from emission_factors import factor_registry
+from response_cache import ResponseCache, user_etag
+
+HISTORY_DAYS = 730     # days of activity history a fit looks back over
+HORIZON_DAYS = 730     # days projected ahead; credits lasting longer report no depletion date
+MIN_TREND_DAYS = 28    # shorter histories are fitted as a level (plus seasonality) without a trend
+MAX_SCENARIOS = 64     # what-if scenarios per call
+MAX_USERS = 1024       # users with memoized fits, least recently active evicted first
+WEEK, YEAR = 7.0, 365.25
+_EPOCH = np.datetime64("1970-01-01", "D")
+
+
+# --- Model ---
+def _design(days, origin, history_days):
+    """Regression columns for day numbers `days`: level, trend (per year, from `origin`), weekly and yearly cycles.
+
+    Terms are only included once the history is long enough to pin them
+    down, so a user with a week of data gets a level rather than a trend
+    extrapolated from a handful of points.
+    """
+    days = np.asarray(days, dtype=float)
+    columns = [np.ones_like(days)]
+    if history_days >= MIN_TREND_DAYS:
+        columns.append((days - origin) / YEAR)
+    cycles = [(WEEK, 2)] if history_days >= 2 * WEEK else []
+    if history_days >= YEAR:
+        cycles.append((YEAR, 1))
+    for period, harmonics in cycles:
+        for k in range(1, harmonics + 1):
+            angle = 2 * np.pi * k * days / period
+            columns += [np.sin(angle), np.cos(angle)]
+    return np.column_stack(columns)
+
+
+class Fit:
+    """Per-activity-type daily amount model for one user, fitted over their recent history.
+
+    The history is a dense (day x activity type) float32 matrix of summed
+    amounts with zero-filled days, from the user's first activity in the
+    window to `today`. One least-squares solve fits every type's column at
+    once; `coefficients` is (terms x types), so projecting any horizon is a
+    single matrix product. Amounts rather than emissions are modelled, so
+    projections are priced with the factors in effect on each future day
+    and what-if swaps can move amounts between types.
+    """
+
+    def __init__(self, types, coefficients, origin, history_days, today):
+        self.types = types
+        self.coefficients = coefficients
+        self.origin = origin
+        self.history_days = history_days
+        self.today = today
+
+    @classmethod
+    def load(cls, user_id, today, history_days=HISTORY_DAYS):
+        rows = (
+            db.session.query(Activity.date, Activity.activity_type, func.sum(Activity.amount))
+            .filter(Activity.user_id == user_id,
+                    Activity.date > today - timedelta(days=history_days), Activity.date <= today)
+            .group_by(Activity.date, Activity.activity_type)
+            .all()
+        )
+        end = (np.datetime64(today, "D") - _EPOCH).astype(np.int64)
+        if not rows:
+            return cls((), np.zeros((1, 0)), end, 0, today)
+        days = (np.array([r[0] for r in rows], dtype="datetime64[D]") - _EPOCH).astype(np.int64)
+        types, columns = np.unique(np.array([r[1] for r in rows], dtype=object), return_inverse=True)
+        first = days.min()
+        amounts = np.zeros((end - first + 1, len(types)), dtype=np.float32)
+        amounts[days - first, columns] = [r[2] for r in rows]
+
+        span = len(amounts)
+        design = _design(np.arange(first, end + 1), end, span)
+        coefficients, *_ = np.linalg.lstsq(design, amounts.astype(float), rcond=None)
+        return cls(tuple(types.tolist()), coefficients, end, span, today)
+
+    def amounts(self, days):
+        """Projected daily amounts (days x types) on day numbers `days`; never negative."""
+        if not self.types:
+            return np.zeros((len(days), 0))
+        return np.clip(_design(days, self.origin, self.history_days) @ self.coefficients, 0.0, None)
+
+
+# --- Scenarios ---
+def parse_scenarios(raw):
+    """Validate what-if scenarios: [{"name": str, "swaps": [{"from": type, "to": type or None, "share": 0..1}]}].
+
+    A swap moves `share` of the projected "from" amount to the "to" type
+    (e.g. car km to train km), or drops it when "to" is None. Raises
+    ValueError with a message fit for a 400 response.
+    """
+    if not isinstance(raw, list) or len(raw) > MAX_SCENARIOS:
+        raise ValueError(f"Scenarios must be a list of at most {MAX_SCENARIOS}.")
+    known = factor_registry.factors()
+    scenarios = []
+    for i, scenario in enumerate(raw):
+        swaps = scenario.get("swaps") if isinstance(scenario, dict) else None
+        if not isinstance(swaps, list) or not swaps:
+            raise ValueError(f"Scenario {i + 1} needs a list of swaps.")
+        moved = {}
+        parsed = []
+        for swap in swaps:
+            if not isinstance(swap, dict):
+                raise ValueError(f"Scenario {i + 1}: each swap needs a from type, a to type and a share.")
+            source, target = swap.get("from"), swap.get("to") or None
+            try:
+                share = float(swap.get("share", 1.0))
+            except (TypeError, ValueError):
+                raise ValueError(f"Scenario {i + 1}: share must be a number.")
+            for activity_type in (source, target) if target is not None else (source,):
+                if activity_type not in known:
+                    raise ValueError(f"Scenario {i + 1}: unknown activity type {activity_type!r}.")
+            if source == target or not 0 < share <= 1:
+                raise ValueError(f"Scenario {i + 1}: swaps need two different types and a share in (0, 1].")
+            moved[source] = moved.get(source, 0.0) + share
+            if moved[source] > 1 + 1e-9:
+                raise ValueError(f"Scenario {i + 1} moves more than all of {source}.")
+            parsed.append({"from": source, "to": target, "share": share})
+        scenarios.append({"name": str(scenario.get("name") or f"Scenario {i + 1}"), "swaps": parsed})
+    return scenarios
+
+
+def evaluate(fit, credits, scenarios, horizon_days=HORIZON_DAYS):
+    """Project the baseline and every scenario in one batch; returns one result dict per scenario, baseline first.
+
+    Swaps are flattened across scenarios into (source, target, share)
+    columns, each swap's daily change in emissions is computed for all of
+    them at once, and a (swaps x scenarios) indicator matrix sums them into
+    per-scenario daily totals. Cumulative emissions (kg) against the
+    remaining credits (tonnes) give each scenario's depletion day.
+    """
+    types = list(fit.types)
+    index = {t: i for i, t in enumerate(types)}
+    for scenario in scenarios:
+        for swap in scenario["swaps"]:
+            for t in (swap["from"], swap["to"]):
+                if t is not None and t not in index:
+                    index[t] = len(types)
+                    types.append(t)
+
+    days = fit.origin + np.arange(1, horizon_days + 1)
+    amounts = np.zeros((horizon_days, len(types)))
+    amounts[:, :len(fit.types)] = fit.amounts(days)
+    dates = (days + _EPOCH).astype("datetime64[D]")
+    factors = factor_registry.factors_at(np.repeat(np.array(types, dtype=object), horizon_days),
+                                         np.tile(dates, len(types))).reshape(len(types), horizon_days).T
+    baseline = (amounts * factors).sum(axis=1)
+
+    swaps = [(s, swap) for s, scenario in enumerate(scenarios, start=1) for swap in scenario["swaps"]]
+    daily = np.repeat(baseline[:, None], len(scenarios) + 1, axis=1)
+    if swaps:
+        source = np.array([index[w["from"]] for _, w in swaps])
+        target = np.array([index[w["to"]] if w["to"] is not None else -1 for _, w in swaps])
+        share = np.array([w["share"] for _, w in swaps])
+        target_factors = np.where(target >= 0, factors[:, target], 0.0)
+        change = amounts[:, source] * (target_factors - factors[:, source]) * share
+        owner = np.zeros((len(swaps), len(scenarios) + 1))
+        owner[np.arange(len(swaps)), [s for s, _ in swaps]] = 1.0
+        daily += change @ owner
+
+    cumulative = np.cumsum(daily, axis=0)
+    budget = max(credits, 0.0) * 1000  # credits are tonnes, emissions kg
+    reached = cumulative >= budget
+    depleted = reached.any(axis=0) | (budget <= 0)
+    first = np.where(budget <= 0, 0, reached.argmax(axis=0) + 1)
+    month = daily[:30].mean(axis=0)
+
+    results = []
+    for s, name in enumerate(["Current pace"] + [scenario["name"] for scenario in scenarios]):
+        days_left = int(first[s]) if depleted[s] else None
+        results.append({
+            "name": name,
+            "kg_per_day": round(float(month[s]), 3),
+            "projected_kg": round(float(cumulative[-1, s]), 2),
+            "days_left": days_left,
+            "depletion_date": (fit.today + timedelta(days=days_left)).isoformat() if days_left is not None else None,
+        })
+    return results
+
+
+# --- Memoized entry point ---
+def projection_etag(user):
+    """user_etag plus today's date: projections start from today, so they go stale at midnight."""
+    return f"{user_etag(user)}-{date.today().isoformat()}"
+
+
+class Projector:
+    """Credit outlook and what-if projections per user, memoized per user data version.
+
+    The fit and every evaluated scenario set are kept in a per-user LRU
+    under the user's ETag (data version and factor version) plus today's
+    date, so repeated dashboard views and API calls reuse them until the
+    user's data, their credits or the emission factors change.
+    """
+
+    def __init__(self, history_days=HISTORY_DAYS, horizon_days=HORIZON_DAYS, max_users=MAX_USERS):
+        self.history_days = history_days
+        self.horizon_days = horizon_days
+        self._memo = ResponseCache(max_users=max_users)
+
+    def init_app(self, app):
+        self.history_days = app.config.get("PROJECTION_HISTORY_DAYS", HISTORY_DAYS)
+        self.horizon_days = app.config.get("PROJECTION_HORIZON_DAYS", HORIZON_DAYS)
+        self._memo.clear()
+
+    def project(self, user, scenarios=()):
+        """[baseline, *scenarios] results for `user`; scenarios as returned by parse_scenarios."""
+        today = date.today()
+        etag = projection_etag(user)
+        key = ("results", json.dumps(scenarios, sort_keys=True))
+        results = self._memo.get(user.id, key, etag)
+        if results is None:
+            fit = self._memo.get(user.id, "fit", etag)
+            if fit is None:
+                fit = Fit.load(user.id, today, self.history_days)
+                self._memo.put(user.id, "fit", etag, fit)
+            results = evaluate(fit, user.credits, list(scenarios), self.horizon_days)
+            self._memo.put(user.id, key, etag, results)
+        return results
+
+
+projector = Projector()
@@ -0,0 +1,125 @@
+"""Query-plan regression check for the hot routes.
+
+Drives dashboard(), marketplace() and emission_calculation() through the
+Flask test client against a scratch SQLite database, records every SQL
+statement they issue, and runs EXPLAIN QUERY PLAN on each one. Any plan
+step that scans a whole table (outside ALLOWED_SCANS) is a failure.
+
+    python query_plans.py        # exits 1 and prints offending plans on regression
+"""
+import os
+import re
+import sys
+import tempfile
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+# Small, intentionally fully-loaded catalog tables
+ALLOWED_SCANS = {"emission_factor", "emission_factor_version", "offset_program"}
+SCAN = re.compile(r"^SCAN (\w+)")
+
+
+@contextmanager
+def capture_queries(engine):
+    """Collect (statement, parameters) for everything executed on `engine`."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def explain(engine, statement, parameters):
+    raw = engine.raw_connection()
+    try:
+        return [row[-1] for row in raw.cursor().execute("EXPLAIN QUERY PLAN " + statement, parameters)]
+    finally:
+        raw.close()
+
+
+def full_scans(plan):
+    return [step for step in plan if (m := SCAN.match(step)) and m.group(1) not in ALLOWED_SCANS]
+
+
+def check(app, db, requests):
+    """Run `requests(client)` and return [(statement, plan)] for every plan with a full scan."""
+    failures = []
+    with app.app_context():
+        engine = db.engine
+    client = app.test_client()
+    with app.app_context():
+        seed(client)
+    with capture_queries(engine) as statements:
+        requests(client)
+    for statement, parameters in statements:
+        if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT", "WITH")):
+            continue
+        plan = explain(engine, statement, parameters)
+        if full_scans(plan):
+            failures.append((statement, plan))
+    return failures
+
+
+def seed(client):
+    for name in ("planner_seller", "planner"):
+        client.post("/register", data={"username": name, "password": "pw"})
+        client.post("/activity_entry", data={
+            "activity_type[]": ["Electricity Usage", "Bus Travel"],
+            "description[]": ["", ""], "amount[]": ["120", "14"],
+            "unit[]": ["kWh", "km"], "date[]": ["2024-01-01", "2024-01-02"],
+        })
+        client.post("/create_listing", data={"credits": "0.5", "price_per_credit": "100"})
+    # Leaves "planner" logged in for the measured requests
+
+
+def hot_routes(client):
+    client.get("/dashboard")
+    client.get("/dashboard?date=2024-01-01")
+    client.get("/dashboard?activities_after=2024-01-02~999999~5.0"
+               "&purchases_after=2030-01-01T00:00:00~999999&offsets_after=2030-01-01T00:00:00~999999")
+    for feed in ("emissions", "activities", "transactions", "offsets", "projection"):
+        client.get(f"/api/{feed}")
+    for kind in ("activities", "emissions", "offsets"):
+        client.get(f"/export/{kind}.csv?start=2024-01-01&end=2024-12-31")
+    client.get("/marketplace")
+    client.post("/emission", data={"date": "2024-01-01"})
+    client.post("/cancel_listing/2")
+    with client.application.app_context():
+        import settlement
+        settlement.expire_due()
+        settlement.next_expiry()
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="query-plans-")
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "plans.db")
+
+    from app import create_app
+    from models import db
+    from migrations import upgrade
+    from setup_emission_factors import initialize_emission_factors
+
+    app = create_app(TESTING=True)
+    with app.app_context():
+        upgrade()
+        initialize_emission_factors()
+
+    failures = check(app, db, hot_routes)
+    for statement, plan in failures:
+        print("FULL SCAN:", " ".join(statement.split()))
+        for step in plan:
+            print("    ", step)
+    print(f"{len(failures)} statement(s) with full table scans.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
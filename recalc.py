@@ -0,0 +1,146 @@
+import threading
+
+import numpy as np
+from sqlalchemy import exists, func, insert
+
+from models import db, User, Activity, EmissionRecord, CacheVersion
+from emission_factors import factor_registry, FACTOR_VERSION_KEY
+from cache_versions import get_version, bump_data_versions
+from rollup import set_daily_emissions
+from db_helpers import upsert
+import analytics
+
+BATCH_USERS = 500
+RECALC_VERSION_KEY = "emission_recalc"  # factor version the stored emissions were computed with
+
+
+# --- One grouped pass ---
+def daily_totals(user_ids=None, start=None, end=None, factor_index=None):
+    """(user_id, date, kg CO₂e) for every user-day with activities.
+
+    SQL sums amounts per (user, date, type); NumPy prices each group with
+    the factor in effect on its date and adds them up per (user, date).
+    """
+    if factor_index is None:
+        factor_index = factor_registry.index()
+    query = db.session.query(Activity.user_id, Activity.date, Activity.activity_type, func.sum(Activity.amount))
+    query = _in_scope(query, Activity, user_ids, start, end)
+    groups = (
+        query.group_by(Activity.user_id, Activity.date, Activity.activity_type)
+        .order_by(Activity.user_id, Activity.date).all()
+    )
+    if not groups:
+        return []
+    user_col, date_col, types, amounts = zip(*groups)
+    emissions = np.array(amounts, dtype=float) * factor_index.factors_at(types, date_col)
+    users = np.array(user_col)
+    days = np.array(date_col, dtype="datetime64[D]")
+    starts = np.flatnonzero(np.r_[True, (users[1:] != users[:-1]) | (days[1:] != days[:-1])])
+    totals = np.add.reduceat(emissions, starts)
+    return [(user_col[i], date_col[i], total) for i, total in zip(starts.tolist(), totals.tolist())]
+
+
+def apply_totals(totals, user_ids=None, start=None, end=None):
+    """Replace EmissionRecords in scope with exactly one record per (user, date) and sync the rollup.
+
+    Only days that have activities are replaced, so re-running the same
+    scope is idempotent. Caller commits.
+    """
+    has_activity = exists().where(
+        Activity.user_id == EmissionRecord.user_id, Activity.date == EmissionRecord.date
+    )
+    stale = _in_scope(EmissionRecord.query, EmissionRecord, user_ids, start, end).filter(has_activity)
+    stale.delete(synchronize_session=False)
+    rows = [{"user_id": u, "date": d, "emission_value": v} for u, d, v in totals]
+    if rows:
+        db.session.execute(insert(EmissionRecord), rows)
+        set_daily_emissions(rows)
+        bump_data_versions([r["user_id"] for r in rows])
+    return len(rows)
+
+
+def _in_scope(query, model, user_ids, start, end):
+    if user_ids is not None:
+        query = query.filter(model.user_id.in_(user_ids))
+    if start is not None:
+        query = query.filter(model.date >= start)
+    if end is not None:
+        query = query.filter(model.date <= end)
+    return query
+
+
+# --- Engine ---
+def recalculate(start=None, end=None, user_ids=None, batch_size=BATCH_USERS):
+    """Recompute daily emissions for a date range and set of users (default: everyone).
+
+    Users are processed in batches of `batch_size`, each batch one grouped
+    query and one short committed transaction. Returns the user-days written.
+    """
+    factor_index = factor_registry.index()
+    written = 0
+    for batch in _user_batches(user_ids, batch_size):
+        totals = daily_totals(batch, start, end, factor_index)
+        written += apply_totals(totals, batch, start, end)
+        analytics.refresh_emissions(batch, start, end, factor_index)
+        db.session.commit()
+    return written
+
+
+def _user_batches(user_ids, batch_size):
+    if user_ids is not None:
+        user_ids = sorted(set(user_ids))
+        for i in range(0, len(user_ids), batch_size):
+            yield user_ids[i:i + batch_size]
+        return
+    last_id = 0
+    while True:
+        batch = [
+            i for (i,) in db.session.query(User.id)
+            .filter(User.id > last_id).order_by(User.id).limit(batch_size)
+        ]
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]
+
+
+# --- Background recompute after factor changes ---
+def recompute_if_stale():
+    """Recompute every user if the factors changed since the last full run.
+
+    The run is claimed with a conditional UPDATE on the RECALC_VERSION_KEY
+    stamp, so only one worker does it per factor revision. Returns True if
+    this call ran the recompute.
+    """
+    factor_version = get_version(FACTOR_VERSION_KEY)
+    upsert(CacheVersion, [{"name": RECALC_VERSION_KEY, "version": 0}], index_elements=["name"], update={})
+    claimed = CacheVersion.query.filter(
+        CacheVersion.name == RECALC_VERSION_KEY, CacheVersion.version < factor_version
+    ).update({CacheVersion.version: factor_version}, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return False
+    recalculate()
+    return True
+
+
+class RecomputeWorker(threading.Thread):
+    """Daemon thread that polls for factor revisions and recomputes emissions."""
+
+    def __init__(self, app, interval=60.0):
+        super().__init__(name="emission-recompute", daemon=True)
+        self.app = app
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    recompute_if_stale()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception("Emission recompute failed")
+
+    def stop(self):
+        self.stopped.set()
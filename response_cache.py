@@ -0,0 +1,97 @@
+import json
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+from flask_login import current_user
+
+from emission_factors import factor_registry
+
+MAX_USERS = 1024       # users with cached responses, least recently active evicted first
+MAX_PER_USER = 16      # cached responses per user, least recently used evicted first
+
+
+class ResponseCache:
+    """Per-user LRU of rendered response bodies, each stored with the ETag it was built for.
+
+    Entries are only served while the user's ETag is unchanged, so a write
+    that bumps the user's data version makes every entry of that user stale.
+    """
+
+    def __init__(self, max_users=MAX_USERS, max_per_user=MAX_PER_USER):
+        self.max_users = max_users
+        self.max_per_user = max_per_user
+        self._users = OrderedDict()  # user_id -> OrderedDict(key -> (etag, body))
+        self._lock = threading.Lock()
+
+    def get(self, user_id, key, etag):
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries is None:
+                return None
+            self._users.move_to_end(user_id)
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != etag:
+                del entries[key]
+                return None
+            entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, user_id, key, etag, body):
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries is None:
+                entries = self._users[user_id] = OrderedDict()
+                if len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            self._users.move_to_end(user_id)
+            entries[key] = (etag, body)
+            entries.move_to_end(key)
+            if len(entries) > self.max_per_user:
+                entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+response_cache = ResponseCache()
+
+
+def user_etag(user):
+    """ETag for everything derived from `user`'s data: the user's data version and the factor version."""
+    return f"{user.id}-{user.data_version or 0}-{factor_registry.version()}"
+
+
+def cached_json(view=None, *, etag=user_etag):
+    """Serve a view's JSON for the current user with ETag revalidation and the per-user cache.
+
+    The view returns a JSON-serializable object. A matching If-None-Match
+    gets a 304 without running the view; otherwise the body comes from
+    response_cache when the ETag still matches, and the view runs on a miss.
+    `etag(user)` defaults to user_etag; views whose output also depends on
+    something else (such as today's date) pass their own, as
+    @cached_json(etag=...).
+    """
+    if view is None:
+        return lambda view: cached_json(view, etag=etag)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        tag = etag(current_user)
+        if request.if_none_match.contains(tag):
+            response = current_app.response_class(status=304)
+        else:
+            key = (request.endpoint, request.query_string)
+            body = response_cache.get(current_user.id, key, tag)
+            if body is None:
+                body = json.dumps(view(*args, **kwargs), separators=(",", ":"))
+                response_cache.put(current_user.id, key, tag, body)
+            response = current_app.response_class(body, mimetype="application/json")
+        response.set_etag(tag)
+        response.headers["Cache-Control"] = "private, no-cache"  # always revalidate
+        return response
+    return wrapper
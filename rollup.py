@@ -0,0 +1,69 @@
+import numpy as np
+from sqlalchemy import func, insert
+
+from models import db, EmissionRecord, DailyEmission
+from db_helpers import upsert
+
+
+# --- Incremental maintenance (called alongside EmissionRecord writes) ---
+def add_emissions(user_id, dates, values):
+    """Add per-row emissions (kg) to the user's daily rollup, one upsert per distinct day."""
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    if not len(dates):
+        return
+    days, inverse = np.unique(dates, return_inverse=True)
+    totals = np.bincount(inverse, weights=np.asarray(values, dtype=float))
+    upsert(
+        DailyEmission,
+        [
+            {"user_id": user_id, "date": day, "emission_value": total}
+            for day, total in zip(days.astype(object), totals.tolist())
+        ],
+        index_elements=["user_id", "date"],
+        update={"emission_value": lambda ex: DailyEmission.emission_value + ex.emission_value},
+    )
+
+
+def set_daily_emissions(rows):
+    """Overwrite rollup rows with recalculated totals: rows are dicts of user_id, date, emission_value."""
+    upsert(
+        DailyEmission, rows,
+        index_elements=["user_id", "date"],
+        update={"emission_value": lambda ex: ex.emission_value},
+    )
+
+
+# --- Reads ---
+def daily_series(user_id):
+    return (
+        db.session.query(DailyEmission.date, DailyEmission.emission_value)
+        .filter(DailyEmission.user_id == user_id)
+        .order_by(DailyEmission.date.asc())
+        .all()
+    )
+
+
+# --- Rebuild / backfill ---
+def rebuild(user_ids=None):
+    """Rebuild DailyEmission from EmissionRecord with one grouped pass. Caller commits.
+
+    Run recalc.recalculate() first to collapse duplicate EmissionRecords.
+    Returns the number of (user, date) rows in the rebuilt rollup.
+    """
+    rollup = DailyEmission.query
+    records = (
+        db.session.query(EmissionRecord.user_id, EmissionRecord.date, func.sum(EmissionRecord.emission_value))
+        .filter(EmissionRecord.user_id.isnot(None), EmissionRecord.date.isnot(None))
+        .group_by(EmissionRecord.user_id, EmissionRecord.date)
+    )
+    if user_ids is not None:
+        rollup = rollup.filter(DailyEmission.user_id.in_(user_ids))
+        records = records.filter(EmissionRecord.user_id.in_(user_ids))
+    rollup.delete(synchronize_session=False)
+    records = records.all()
+    if records:
+        db.session.execute(insert(DailyEmission), [
+            {"user_id": user_id, "date": day, "emission_value": value or 0.0}
+            for user_id, day, value in records
+        ])
+    return len(records)
@@ -0,0 +1,291 @@
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import func, insert, literal, select, update
+from sqlalchemy.exc import OperationalError
+
+from models import db, User, MarketplaceListing, Transaction, OffsetTransaction
+from cache_versions import bump_version, next_data_version
+from db_helpers import is_retryable
+from orderbook import ORDER_BOOK_VERSION_KEY, Fill
+import analytics
+import ledger
+from ledger import leg
+
+MAX_ATTEMPTS = 5
+BACKOFF = 0.01  # seconds, doubled per retry with jitter
+EPSILON = 1e-9
+EXPIRY_BATCH = 500  # listings withdrawn per expiry transaction
+
+
+class SettlementError(Exception):
+    pass
+
+class InsufficientCredits(SettlementError):
+    pass
+
+class InsufficientFunds(SettlementError):
+    pass
+
+class ListingUnavailable(SettlementError):
+    pass
+
+
+# --- Transaction runner ---
+def atomic(work, attempts=MAX_ATTEMPTS):
+    """Run work() in one transaction and commit, retrying when SQLite reports busy/locked
+    or Postgres a serialization failure or deadlock.
+
+    SettlementErrors roll back and propagate immediately. work() must only
+    touch the database through the session so it can be re-run from scratch.
+    """
+    for attempt in range(attempts):
+        try:
+            result = work()
+            db.session.commit()
+            return result
+        except OperationalError as e:
+            db.session.rollback()
+            if not is_retryable(e) or attempt == attempts - 1:
+                raise
+            time.sleep(BACKOFF * 2 ** attempt * (0.5 + random.random()))
+        except SettlementError:
+            db.session.rollback()
+            raise
+
+
+# --- Compare-and-swap balance updates ---
+# Every balance UPDATE also bumps the user's data_version (cached dashboard data).
+def debit_credits(user_id, amount):
+    _cas_update(user_id, User.credits, -amount, InsufficientCredits)
+
+def debit_wallet(user_id, amount):
+    _cas_update(user_id, User.wallet_balance, -amount, InsufficientFunds)
+
+def credit_user(user_id, credits=0.0, wallet=0.0):
+    db.session.execute(
+        update(User).where(User.id == user_id)
+        .values(credits=User.credits + credits, wallet_balance=User.wallet_balance + wallet,
+                data_version=next_data_version(user_id))
+    )
+
+def _cas_update(user_id, column, delta, error):
+    result = db.session.execute(
+        update(User)
+        .where(User.id == user_id, column >= -delta - EPSILON)
+        .values({column: column + delta, User.data_version: next_data_version(user_id)})
+    )
+    if result.rowcount != 1:
+        raise error(user_id)
+
+
+# --- Listing state transitions ---
+def claim_listing(listing_id, credits, price, revision):
+    """Take `credits` from an available listing at `price`, or raise ListingUnavailable.
+
+    Taking the whole listing marks it sold. Taking part of it splits the
+    listing: the original keeps the remainder and its time priority, and a
+    sold listing is inserted for the part that was taken.
+    """
+    listing = MarketplaceListing
+    claimable = [listing.id == listing_id, listing.status == "available", listing.price_per_credit == price]
+    whole = db.session.execute(
+        update(listing)
+        .where(*claimable, func.abs(listing.credits - credits) <= EPSILON)
+        .values(status="sold", revision=revision)
+    )
+    if whole.rowcount == 1:
+        return
+    part = db.session.execute(
+        update(listing)
+        .where(*claimable, listing.credits > credits + EPSILON)
+        .values(
+            credits=listing.credits - credits,
+            total_price=(listing.credits - credits) * listing.price_per_credit,
+            revision=revision,
+        )
+    )
+    if part.rowcount != 1:
+        raise ListingUnavailable(listing_id)
+    db.session.execute(insert(listing).from_select(
+        ["user_id", "credits", "price_per_credit", "total_price", "status", "created_at", "revision"],
+        select(
+            listing.user_id, literal(credits), listing.price_per_credit,
+            literal(credits) * listing.price_per_credit, literal("sold"), listing.created_at, literal(revision),
+        ).where(listing.id == listing_id),
+    ))
+
+
+# --- Settlement operations (each runs and commits in its own transaction) ---
+def settle_fills(buyer_id, fills):
+    """Settle order-book Fills for `buyer_id` atomically."""
+    def work():
+        revision = bump_version(ORDER_BOOK_VERSION_KEY)  # first write takes the lock
+        for f in fills:
+            claim_listing(f.listing_id, f.credits, f.price, revision)
+        cost = sum(f.amount for f in fills)
+        debit_wallet(buyer_id, cost)
+        credit_user(buyer_id, credits=sum(f.credits for f in fills))
+        proceeds = defaultdict(float)
+        for f in fills:
+            proceeds[f.seller_id] += f.amount
+        for seller_id, amount in proceeds.items():
+            credit_user(seller_id, wallet=amount)
+        db.session.execute(insert(Transaction), [
+            {"buyer_id": buyer_id, "seller_id": f.seller_id,
+             "credits_transferred": f.credits, "total_amount": f.amount}
+            for f in fills
+        ])
+        analytics.add_trades([(f.credits, f.amount) for f in fills])
+        for f in fills:
+            ledger.post("trade",
+                        leg("escrow", -f.credits), leg("credits", f.credits, buyer_id),
+                        leg("wallet", -f.amount, buyer_id), leg("wallet", f.amount, f.seller_id))
+        return fills
+
+    return atomic(work)
+
+def buy_listing(buyer_id, listing_id, seller_id, credits, price):
+    """Buy a whole listing, as last seen with `credits` at `price`."""
+    return settle_fills(buyer_id, [Fill(listing_id, seller_id, credits, price)])
+
+def create_listing(seller_id, credits, price_per_credit, expires_at=None):
+    """Escrow the seller's credits and open a listing, optionally expiring at `expires_at` (UTC). Returns its id."""
+    def work():
+        revision = bump_version(ORDER_BOOK_VERSION_KEY)  # same lock order as settle_fills and withdrawals
+        debit_credits(seller_id, credits)
+        ledger.post("escrow", leg("credits", -credits, seller_id), leg("escrow", credits))
+        listing = MarketplaceListing(
+            user_id=seller_id, credits=credits, price_per_credit=price_per_credit,
+            total_price=credits * price_per_credit,
+            revision=revision,
+            expires_at=expires_at,
+        )
+        db.session.add(listing)
+        db.session.flush()
+        return listing.id
+
+    return atomic(work)
+
+def cancel_listing(seller_id, listing_id):
+    """Withdraw one of the seller's available listings and refund its escrow. Returns the credits refunded."""
+    def work():
+        revision = bump_version(ORDER_BOOK_VERSION_KEY)
+        withdrawn = withdraw_listings([MarketplaceListing.id == listing_id, MarketplaceListing.user_id == seller_id],
+                                      "cancelled", revision)
+        if not withdrawn:
+            raise ListingUnavailable(listing_id)
+        return withdrawn[0][2]
+
+    return atomic(work)
+
+def expire_listings(now=None, limit=EXPIRY_BATCH):
+    """Expire up to `limit` available listings past their expires_at, refunding escrow. Returns how many.
+
+    Due listings are found through the (status, expires_at) index, so a
+    sweep reads only the rows it expires; the order book is only bumped
+    when something is due.
+    """
+    now = now or datetime.utcnow()
+    def work():
+        due = [i for (i,) in db.session.execute(
+            select(MarketplaceListing.id)
+            .where(MarketplaceListing.status == "available", MarketplaceListing.expires_at <= now)
+            .order_by(MarketplaceListing.expires_at).limit(limit)
+        )]
+        if not due:
+            return 0
+        revision = bump_version(ORDER_BOOK_VERSION_KEY)
+        return len(withdraw_listings([MarketplaceListing.id.in_(due)], "expired", revision))
+
+    return atomic(work)
+
+def withdraw_listings(conditions, status, revision):
+    """Move available listings matching `conditions` to `status` and refund their escrow to the sellers.
+
+    The conditional UPDATE only takes listings still available, so a
+    listing sold or withdrawn concurrently is skipped rather than refunded
+    twice. Returns the (id, seller_id, credits) withdrawn.
+    """
+    withdrawn = db.session.execute(
+        update(MarketplaceListing)
+        .where(*conditions, MarketplaceListing.status == "available")
+        .values(status=status, revision=revision)
+        .returning(MarketplaceListing.id, MarketplaceListing.user_id, MarketplaceListing.credits)
+    ).all()
+    refunds = defaultdict(float)
+    for _, seller_id, credits in withdrawn:
+        refunds[seller_id] += credits
+    for seller_id in sorted(refunds):
+        credit_user(seller_id, credits=refunds[seller_id])
+    for listing_id, seller_id, credits in withdrawn:
+        ledger.post("refund", leg("escrow", -credits), leg("credits", credits, seller_id))
+    return withdrawn
+
+def offset_credits(user_id, program_id, co2_offset, credits_used):
+    """Spend credits on an offset program."""
+    def work():
+        debit_credits(user_id, credits_used)
+        ledger.post("offset", leg("credits", -credits_used, user_id), leg("offsets", credits_used))
+        db.session.execute(insert(OffsetTransaction), [{
+            "user_id": user_id, "program_id": program_id,
+            "co2_offset": co2_offset, "credits_used": credits_used,
+        }])
+        analytics.add_offset(program_id, co2_offset, credits_used)
+
+    return atomic(work)
+
+
+# --- Listing expiry ---
+def expire_due(now=None):
+    """Expire every listing due by `now`, EXPIRY_BATCH per committed transaction. Returns how many."""
+    now = now or datetime.utcnow()
+    expired = 0
+    while True:
+        count = expire_listings(now)
+        expired += count
+        if count < EXPIRY_BATCH:
+            return expired
+
+def next_expiry():
+    """Earliest expires_at among available listings (a single index probe), or None."""
+    return db.session.query(func.min(MarketplaceListing.expires_at)).filter(
+        MarketplaceListing.status == "available"
+    ).scalar()
+
+
+class ExpiryWorker(threading.Thread):
+    """Daemon thread that expires due listings.
+
+    Sleeps until the earliest expiry it knows of, but never longer than
+    `interval`, so listings created by other workers are picked up too.
+    Several processes may run one: each listing is withdrawn exactly once.
+    """
+
+    def __init__(self, app, interval=60.0):
+        super().__init__(name="listing-expiry", daemon=True)
+        self.app = app
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        wait = 0.0
+        while not self.stopped.wait(wait):
+            wait = self.interval
+            with self.app.app_context():
+                try:
+                    expire_due()
+                    due = next_expiry()
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception("Listing expiry failed")
+                    continue
+            if due is not None:
+                wait = min(self.interval, max((due - datetime.utcnow()).total_seconds(), 0.0) + 0.01)
+
+    def stop(self):
+        self.stopped.set()
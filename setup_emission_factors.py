@@ -1,7 +1,10 @@
-from app import db  
-from models import EmissionFactor
+from datetime import date
 
-def initialize_emission_factors():
+from models import db, EmissionFactor
+from emission_factors import factor_registry, revise_factors
+
+def initialize_emission_factors(valid_from=None):
+    """Seed missing factors; changed factors become revisions effective from `valid_from` (default today)."""
     factors = {
     # --- 🏠 Home Energy ---
     "Electricity Usage": 0.82,             # per kWh (India grid average)
@@ -45,12 +48,18 @@ def initialize_emission_factors():
     "Biogas Program Support": -300         # household-scale offset estimate
 }
 
-    for activity_type, factor in factors.items():
-        existing = EmissionFactor.query.filter_by(activity_type=activity_type).first()
-        if not existing:
-            db.session.add(EmissionFactor(activity_type=activity_type, factor=factor))
-        else:
-            existing.factor = factor  # update if it already exists
+    known = {f.activity_type for f in EmissionFactor.query}
+    added = [
+        EmissionFactor(activity_type=activity_type, factor=factor)
+        for activity_type, factor in factors.items() if activity_type not in known
+    ]
+    if added:
+        db.session.add_all(added)
+        factor_registry.invalidate()  # other workers reload on their next request
 
+    # Existing factors are never overwritten in place, so history keeps its pricing
+    revise_factors(
+        {t: f for t, f in factors.items() if t in known}, valid_from or date.today()
+    )
     db.session.commit()
     print("✅ Emission factors initialized/updated successfully.")
@@ -0,0 +1,18 @@
+from models import db, OffsetProgram
+from cache_versions import bump_version
+from fragment_cache import OFFSET_PROGRAMS_VERSION_KEY
+
+def initialize_offset_programs():
+    """Add the default offset programs to an empty catalog. Returns how many were added."""
+    if OffsetProgram.query.count():
+        return 0
+    programs = [
+        OffsetProgram(name="Tree Plantation Drive", description="Funds planting of new trees.", rate_per_kg=0.5, image="trees.jpg"),
+        OffsetProgram(name="Renewable Energy Project", description="Invests in solar/wind energy.", rate_per_kg=0.8, image="renewable.jpg"),
+        OffsetProgram(name="Ocean Cleanup Program", description="Supports ocean plastic cleanup.", rate_per_kg=1.0, image="ocean.jpg")
+    ]
+    db.session.add_all(programs)
+    bump_version(OFFSET_PROGRAMS_VERSION_KEY)  # cached program catalogs re-render
+    db.session.commit()
+    print("Default offset programs added.")
+    return len(programs)
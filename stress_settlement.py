@@ -0,0 +1,201 @@
+"""Multi-threaded stress harness for the settlement layer.
+
+Runs concurrent whole-listing purchases, order-book buys, listing creation,
+cancellation and expiry, and offsets through settlement.py and the order book (the same calls the
+routes make) against a scratch SQLite database, or the empty database given
+with --database (e.g. Postgres), then checks the ledger invariants:
+
+  * credits are conserved: user credits + open listings + offsets == initial credits
+  * wallet money is conserved across all users
+  * every sold credit has exactly one Transaction (no listing sold twice)
+  * no balance or listing goes negative
+  * the double-entry ledger reconciles with the balances (ledger.reconcile)
+
+    python stress_settlement.py --threads 16 --listings 2000 --seconds 10
+    python stress_settlement.py --database postgresql+psycopg://localhost/stress
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+EPSILON = 1e-6
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--sellers", type=int, default=8)
+    parser.add_argument("--listings", type=int, default=2000)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database", help="URL of an empty database to use (default: a scratch SQLite file)")
+    return parser.parse_args(argv)
+
+
+def setup(app, db, args):
+    from werkzeug.security import generate_password_hash
+    from models import User, MarketplaceListing, OffsetProgram
+    from migrations import upgrade
+    import ledger
+
+    rng = random.Random(args.seed)
+    password = generate_password_hash("pw")
+    with app.app_context():
+        upgrade()
+        db.session.add(OffsetProgram(name="Stress Program", description="-", rate_per_kg=0.01))
+        users = [User(username=f"seller{i}", password=password, credits=10_000.0, wallet_balance=0.0)
+                 for i in range(args.sellers)]
+        users += [User(username=f"buyer{i}", password=password, credits=10.0, wallet_balance=50_000.0)
+                  for i in range(args.threads)]
+        db.session.add_all(users)
+        db.session.flush()
+        sellers = users[:args.sellers]
+        for _ in range(args.listings):
+            seller = rng.choice(sellers)
+            credits = round(rng.uniform(1, 20), 2)
+            price = round(rng.uniform(5, 15), 2)
+            seller.credits -= credits
+            db.session.add(MarketplaceListing(user_id=seller.id, credits=credits, price_per_credit=price,
+                                              total_price=credits * price))
+        db.session.flush()
+        ledger.backfill()
+        db.session.commit()
+        return totals(db)
+
+
+def totals(db):
+    from sqlalchemy import func
+    from models import User, MarketplaceListing, Transaction, OffsetTransaction
+
+    q = db.session.query
+    return {
+        "user_credits": q(func.sum(User.credits)).scalar() or 0.0,
+        "wallets": q(func.sum(User.wallet_balance)).scalar() or 0.0,
+        "open_listing_credits": q(func.sum(MarketplaceListing.credits))
+                                .filter(MarketplaceListing.status == "available").scalar() or 0.0,
+        "sold_listing_credits": q(func.sum(MarketplaceListing.credits))
+                                .filter(MarketplaceListing.status == "sold").scalar() or 0.0,
+        "traded_credits": q(func.sum(Transaction.credits_transferred)).scalar() or 0.0,
+        "offset_credits": q(func.sum(OffsetTransaction.credits_used)).scalar() or 0.0,
+        "min_credits": q(func.min(User.credits)).scalar(),
+        "min_wallet": q(func.min(User.wallet_balance)).scalar(),
+        "min_listing": q(func.min(MarketplaceListing.credits)).scalar(),
+        "transactions": q(func.count(Transaction.id)).scalar(),
+    }
+
+
+def worker(app, db, user_id, listing_ids, deadline, counts, errors, rng):
+    import settlement
+    from models import User, MarketplaceListing
+    from orderbook import order_book
+
+    own_listings = []
+    while time.monotonic() < deadline:
+        action = rng.random()
+        with app.app_context():
+            try:
+                if action < 0.6:
+                    counts["buy"] += 1
+                    listing = db.session.get(MarketplaceListing, rng.choice(listing_ids))
+                    if listing.status == "available":
+                        settlement.buy_listing(user_id, listing.id, listing.user_id,
+                                               listing.credits, listing.price_per_credit)
+                elif action < 0.85:
+                    counts["buy_order"] += 1
+                    order_book.buy(db.session.get(User, user_id), rng.uniform(5, 60), 12.0)
+                elif action < 0.95:
+                    counts["offset"] += 1
+                    co2 = rng.uniform(1, 50)
+                    settlement.offset_credits(user_id, 1, co2, co2 * 0.01)
+                elif action < 0.98:
+                    counts["create_listing"] += 1
+                    expires_at = datetime.utcnow() + timedelta(seconds=rng.uniform(0, 2)) if rng.random() < 0.5 else None
+                    own_listings.append(settlement.create_listing(user_id, 1.0, 9.0, expires_at))
+                elif action < 0.99:
+                    counts["cancel_listing"] += 1
+                    if own_listings:
+                        settlement.cancel_listing(user_id, own_listings.pop(rng.randrange(len(own_listings))))
+                else:
+                    counts["expire"] += 1
+                    settlement.expire_listings()
+            except settlement.SettlementError:
+                pass  # lost a race or ran dry: the expected, safe outcome
+            except Exception as e:  # report, keep hammering
+                errors.append(repr(e))
+
+
+def check(before, after):
+    failures = []
+    credits_before = before["user_credits"] + before["open_listing_credits"]
+    credits_after = after["user_credits"] + after["open_listing_credits"] + after["offset_credits"]
+    if abs(credits_before - credits_after) > EPSILON * max(1.0, credits_before):
+        failures.append(f"credits not conserved: {credits_before:.6f} -> {credits_after:.6f}")
+    if abs(before["wallets"] - after["wallets"]) > EPSILON * max(1.0, before["wallets"]):
+        failures.append(f"wallets not conserved: {before['wallets']:.6f} -> {after['wallets']:.6f}")
+    if abs(after["sold_listing_credits"] - after["traded_credits"]) > EPSILON * max(1.0, after["traded_credits"]):
+        failures.append(f"sold listings ({after['sold_listing_credits']:.6f}) != "
+                        f"traded credits ({after['traded_credits']:.6f})")
+    for key in ("min_credits", "min_wallet", "min_listing"):
+        if after[key] is not None and after[key] < -EPSILON:
+            failures.append(f"negative balance: {key} = {after[key]}")
+    return failures
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.database:
+        os.environ["DATABASE_URL"] = args.database
+    else:
+        workdir = tempfile.mkdtemp(prefix="stress-settlement-")
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "stress.db")
+
+    from app import create_app
+    from models import db, User, MarketplaceListing
+
+    app = create_app(TESTING=True)
+
+    before = setup(app, db, args)
+    with app.app_context():
+        buyer_ids = [u.id for u in User.query.filter(User.username.like("buyer%")).order_by(User.id)]
+        listing_ids = [i for (i,) in db.session.query(MarketplaceListing.id)]
+
+    counts = {"buy": 0, "buy_order": 0, "offset": 0, "create_listing": 0, "cancel_listing": 0, "expire": 0}
+    errors = []
+    deadline = time.monotonic() + args.seconds
+    threads = [
+        threading.Thread(target=worker, args=(app, db, user_id, listing_ids, deadline, counts, errors,
+                                              random.Random(args.seed + i)))
+        for i, user_id in enumerate(buyer_ids)
+    ]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    with app.app_context():
+        import ledger
+        after = totals(db)
+        failures = check(before, after)
+        ledger.take_snapshots()
+        db.session.commit()
+        failures += ledger.reconcile()
+
+    requests = sum(counts.values())
+    print(f"{requests} requests in {elapsed:.1f}s ({requests / elapsed:.0f}/s) on {args.threads} threads: {counts}")
+    print(f"{after['transactions']} trades settled ({after['transactions'] / elapsed:.0f}/s), {len(errors)} errors")
+    for e in errors[:10]:
+        print("  error:", e)
+    for f in failures:
+        print("INVARIANT VIOLATED:", f)
+    return 1 if failures or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from models import db, User
+
+TTL = 5.0             # seconds a cached identity is trusted; bounds staleness across worker processes
+MAX_ENTRIES = 10000
+
+
+class UserCache:
+    """Short-TTL cache of User rows for Flask-Login's load_user.
+
+    Hits rebuild the User from cached column values and attach it to the
+    session without a query. Committed transactions drop every user they
+    touched (cache_versions.touch_users, called for each balance or
+    password UPDATE), so this process never serves a stale row; other
+    processes may for at most USER_CACHE_TTL seconds. A load that started
+    before an invalidation is not cached, so a row read just before a
+    concurrent commit cannot be stored after it.
+    """
+
+    def __init__(self, ttl=TTL, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # user_id -> (expires_at, column values)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get("USER_CACHE_TTL", TTL)
+        self.clear()
+
+    def load(self, user_id):
+        if self.ttl <= 0:
+            return db.session.get(User, user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            generation = self._generation
+        if entry is not None and entry[0] > now:
+            return self._attach(entry[1])
+        user = db.session.get(User, user_id)
+        if user is not None:
+            values = {c.key: getattr(user, c.key) for c in User.__table__.columns}
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[user_id] = (now + self.ttl, values)
+                    self._entries.move_to_end(user_id)
+                    if len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+        return user
+
+    @staticmethod
+    def _attach(values):
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_touched_users(session):
+    touched = session.info.pop("touched_users", None)
+    if touched:
+        user_cache.invalidate(touched)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_touched_users(session):
+    session.info.pop("touched_users", None)
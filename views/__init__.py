@@ -0,0 +1,13 @@
+"""Route blueprints, one per subsystem.
+
+Nothing here is imported until create_app() registers the blueprints, so
+the CLI and scripts that only need the database layer never load the
+view modules or what they pull in (numpy, ingest, settlement, ...).
+"""
+
+
+def register_blueprints(app):
+    from views import auth, activities, marketplace, offsets, reports
+
+    for module in (auth, activities, marketplace, offsets, reports):
+        app.register_blueprint(module.bp)
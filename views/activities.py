@@ -0,0 +1,220 @@
+from datetime import datetime
+
+from flask import Blueprint, Response, render_template, url_for, request, abort, stream_with_context
+from flask_login import login_required, current_user
+
+from models import db
+import recalc
+from emission_factors import factor_registry
+from projection import projector, parse_scenarios, projection_etag
+from dashboard_data import emission_series, purchases_page, offsets_page, activities_page
+from response_cache import cached_json
+from ingest import IngestError, ingest_rows, ingest_stream, form_rows, read_upload
+from write_behind import write_behind, WriteBehindFull
+from export import ExportError, FORMATS, stream_export
+
+bp = Blueprint("activities", __name__)
+
+# Dashboard with Emission, Marketplace, Offset & Activity History
+@bp.route('/dashboard')
+@login_required
+def dashboard():
+    user = current_user
+
+    emission_data = emission_series(user)
+    marketplace_data, next_purchases = purchases_page(user, request.args.get('purchases_after'))
+    offset_transactions, next_offsets = offsets_page(user, request.args.get('offsets_after'))
+    filter_date = request.args.get('date')
+    activity_data, next_activities = activities_page(user, filter_date, request.args.get('activities_after'))
+
+    # --- "Older" links; each feed pages independently of the others ---
+    def older(arg, cursor):
+        if cursor is None:
+            return None
+        return url_for('.dashboard', **{**request.args.to_dict(), arg: cursor})
+
+    next_pages = {
+        "activities": older('activities_after', next_activities),
+        "purchases": older('purchases_after', next_purchases),
+        "offsets": older('offsets_after', next_offsets),
+    }
+
+    # --- Credit outlook, plus the what-if swap from the form under it ---
+    what_if, what_if_error, scenarios = request.args.to_dict(), None, []
+    if what_if.get('swap_from'):
+        try:
+            scenarios = parse_scenarios([{"name": "What if", "swaps": [{
+                "from": what_if['swap_from'], "to": what_if.get('swap_to'),
+                "share": request.args.get('swap_share', 100, type=float) / 100,
+            }]}])
+        except ValueError as e:
+            what_if_error = str(e)
+    outlook = projector.project(user, scenarios)
+
+    return render_template(
+        'dashboard.html',
+        user=user,
+        emission_data=emission_data,
+        marketplace_transactions=marketplace_data,
+        offset_transactions=offset_transactions,
+        activity_data=activity_data,
+        filter_date=filter_date,
+        next_pages=next_pages,
+        outlook=outlook,
+        horizon_days=projector.horizon_days,
+        what_if=what_if,
+        what_if_error=what_if_error,
+        activity_types=sorted(factor_registry.factors()),
+    )
+
+# Read-only JSON API for the dashboard feeds (ETag + per-user response cache)
+@bp.route('/api/emissions')
+@login_required
+@cached_json
+def api_emissions():
+    return {"items": emission_series(current_user)}
+
+@bp.route('/api/activities')
+@login_required
+@cached_json
+def api_activities():
+    items, next_cursor = activities_page(current_user, request.args.get('date'), request.args.get('after'))
+    return {"items": items, "next": next_cursor}
+
+@bp.route('/api/transactions')
+@login_required
+@cached_json
+def api_transactions():
+    items, next_cursor = purchases_page(current_user, request.args.get('after'))
+    return {"items": items, "next": next_cursor}
+
+@bp.route('/api/offsets')
+@login_required
+@cached_json
+def api_offsets():
+    items, next_cursor = offsets_page(current_user, request.args.get('after'))
+    return {"items": items, "next": next_cursor}
+
+# Credit depletion projection: GET for the current pace, POST {"scenarios": [...]} for what-ifs (see projection.py)
+@bp.route('/api/projection')
+@login_required
+@cached_json(etag=projection_etag)
+def api_projection():
+    return {"items": projector.project(current_user)}
+
+@bp.route('/api/projection', methods=['POST'])
+@login_required
+def api_projection_scenarios():
+    body = request.get_json(silent=True)
+    try:
+        scenarios = parse_scenarios(body.get("scenarios") if isinstance(body, dict) else None)
+    except ValueError as e:
+        abort(400, description=str(e))
+    return {"items": projector.project(current_user, scenarios)}
+
+# Streaming export of the current user's history: /export/activities.csv?start=2024-01-01&end=2024-03-31
+@bp.route('/export/<kind>.<fmt>')
+@login_required
+def export_history(kind, fmt):
+    try:
+        start, end = (
+            datetime.strptime(request.args[arg], "%Y-%m-%d").date() if request.args.get(arg) else None
+            for arg in ("start", "end")
+        )
+        chunks = stream_export(kind, fmt, [current_user.id], start, end)
+    except (ExportError, ValueError) as e:
+        abort(400, description=str(e))
+    return Response(
+        stream_with_context(chunks),  # no Content-Length: sent with chunked transfer encoding
+        mimetype=FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{fmt}"'},
+    )
+
+# Activity Entry
+@bp.route('/activity_entry', methods=['GET', 'POST'])
+@login_required
+def activity_entry():
+    message = None
+
+    if request.method == 'POST':
+
+        # Validate, price and bulk-insert all rows in one pass
+        try:
+            if write_behind.enabled:
+                try:
+                    count, total_emission = write_behind.submit(current_user.id, form_rows(request.form))
+                    return render_template('activity_entry.html', message=(
+                        f"Saved {count} activities ({total_emission:.2f} kg CO₂e). "
+                        f"They will appear on your dashboard shortly."
+                    ))
+                except WriteBehindFull:
+                    pass  # queue is backed up: write this one synchronously
+            count, total_emission = ingest_rows(current_user, form_rows(request.form))
+        except IngestError as e:
+            db.session.rollback()
+            return render_template('activity_entry.html', message=str(e))
+        db.session.commit()
+
+        '''message = (
+            f"Successfully saved {count} activities. "
+            f"Total emissions: {total_emission:.2f} kg CO₂e. "
+            f"Remaining credits: {current_user.credits:.2f} tCO₂e."
+        )'''
+
+    return render_template('activity_entry.html', message=message)
+
+@bp.route('/activity_upload', methods=['POST'])
+@login_required
+def activity_upload():
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return render_template('activity_entry.html', message="Please choose a CSV or JSON file to upload.")
+
+    # Stream the file through the batch pipeline in chunks; one transaction for the whole upload
+    try:
+        count, total_emission = ingest_stream(current_user, read_upload(file))
+    except IngestError as e:
+        db.session.rollback()
+        return render_template('activity_entry.html', message=f"Upload failed: {e}")
+    db.session.commit()
+
+    message = (
+        f"Imported {count} activities. "
+        f"Total emissions: {total_emission:.2f} kg CO₂e. "
+        f"Remaining credits: {current_user.credits:.2f} tCO₂e."
+    )
+    return render_template('activity_entry.html', message=message)
+
+
+@bp.route("/emission", methods=["GET", "POST"])
+@login_required
+def emission_calculation():
+    daily_emission = None
+    message = None
+
+    if request.method == "POST":
+        date_str = request.form.get("date")
+
+        if not date_str:
+            message = "Please select a date."
+            return render_template("emission_calculation.html", message=message)
+
+        # Convert input text → date
+        date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
+
+        # Sum the day's activities in one grouped query
+        totals = recalc.daily_totals([current_user.id], date_obj, date_obj)
+
+        if not totals:
+            message = f"No activities found for {date_str}."
+            return render_template("emission_calculation.html", message=message)
+
+        # Save one emission record for the day (replaces earlier records, keeps the rollup in sync)
+        recalc.apply_totals(totals, [current_user.id], date_obj, date_obj)
+        db.session.commit()
+        total_emission = totals[0][2]
+
+        message = ( f"Total emission for {date_str}: {total_emission:.3f} kg CO₂e.")
+        daily_emission = total_emission
+
+    return render_template("emission_calculation.html", message=message, daily_emission=daily_emission)
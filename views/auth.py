@@ -0,0 +1,75 @@
+from flask import Blueprint, render_template, redirect, url_for, request, flash
+from flask_login import LoginManager, login_user, login_required, logout_user
+
+from models import db, User
+import ledger
+from passwords import password_hasher, HasherBusy, set_password
+from user_cache import user_cache
+
+bp = Blueprint("auth", __name__)
+
+login_manager = LoginManager()
+login_manager.login_view = "auth.home"
+bp.record_once(lambda state: login_manager.init_app(state.app))
+
+@login_manager.user_loader
+def load_user(user_id):
+    return user_cache.load(int(user_id))
+
+# Homepage & Authentication
+@bp.route("/")
+def home():
+    return render_template("home.html")
+
+@bp.route("/login", methods=["POST"])
+def login():
+    username = request.form["username"]
+    password = request.form["password"]
+    user = User.query.filter_by(username=username).first()
+
+    if not user:
+        return render_template("home.html", message="User does not exist", open_login=True)
+    try:
+        if not password_hasher.verify(user.password, password):
+            return render_template("home.html", message="Invalid username or password", open_login=True)
+        # Upgrade hashes made with older PASSWORD_HASH_METHOD parameters while we have the password
+        if password_hasher.needs_rehash(user.password):
+            set_password(user.id, password_hasher.hash(password))
+            db.session.commit()
+    except HasherBusy:
+        return render_template("home.html", message="Too many sign-ins right now. Please try again.",
+                               open_login=True), 503
+
+    login_user(user)
+    return redirect(url_for("activities.dashboard"))
+
+@bp.route("/register", methods=["POST"])
+def register():
+    username = request.form["username"]
+    password = request.form["password"]
+
+    existing_user = User.query.filter_by(username=username).first()
+    if existing_user:
+        return render_template("home.html", message="Username already exists. Please login.", open_signup=True)
+
+    try:
+        hashed_pw = password_hasher.hash(password)
+    except HasherBusy:
+        return render_template("home.html", message="Too many sign-ups right now. Please try again.",
+                               open_signup=True), 503
+    new_user = User(username=username, password=hashed_pw)
+    db.session.add(new_user)
+    db.session.flush()
+    ledger.open_account(new_user.id, new_user.credits, new_user.wallet_balance)
+    db.session.commit()
+
+    login_user(new_user)
+    return redirect(url_for("activities.dashboard"))
+
+# Logout
+@bp.route("/logout")
+@login_required
+def logout():
+    logout_user()
+    flash("You’ve been logged out successfully.", "info")
+    return redirect(url_for(".home"))
@@ -0,0 +1,142 @@
+import math
+from datetime import datetime, timedelta
+
+from flask import Blueprint, render_template, redirect, url_for, request, flash, get_template_attribute
+from flask_login import login_required, current_user
+from markupsafe import Markup
+
+from models import db, User, MarketplaceListing
+import settlement
+from orderbook import order_book, ORDER_BOOK_VERSION_KEY
+from fragment_cache import fragment_cache
+
+bp = Blueprint("marketplace", __name__)
+
+MAX_LISTING_DAYS = 365  # longest listing duration accepted from the form
+UNAVAILABLE = {
+    "sold": "This listing is already sold!",
+    "cancelled": "This listing was cancelled by the seller.",
+    "expired": "This listing has expired.",
+}
+
+
+def _positive(*values):
+    # float() also accepts "nan" and "inf", which a plain `> 0` check would let through
+    return all(math.isfinite(v) and v > 0 for v in values)
+
+# Marketplace
+@bp.route("/marketplace")
+@login_required
+def marketplace(message=None):
+    # The grid is cached per order-book generation and shared by every viewer;
+    # each card remembers its seller so viewers don't see their own asks.
+    cards = fragment_cache.get_or_render("listing_grid", ORDER_BOOK_VERSION_KEY, render_listing_cards)
+    listing_cards = [Markup(html) for seller_id, html in cards if seller_id != current_user.id]
+    user_listings = MarketplaceListing.query.filter_by(user_id=current_user.id).all()
+    return render_template("marketplace.html", listing_cards=listing_cards, user_listings=user_listings, message=message)
+
+def render_listing_cards():
+    """[seller_id, card html] for every available listing, in price-time priority."""
+    listing_card = get_template_attribute("_listing_card.html", "listing_card")
+    rows = (
+        db.session.query(MarketplaceListing, User.username)
+        .join(User, MarketplaceListing.user_id == User.id)
+        .filter(MarketplaceListing.status == "available")
+        .order_by(MarketplaceListing.price_per_credit, MarketplaceListing.created_at, MarketplaceListing.id)
+    )
+    return [[listing.user_id, str(listing_card(listing, username))] for listing, username in rows]
+
+@bp.route("/create_listing", methods=["GET", "POST"])
+@login_required
+def create_listing():
+    msg, success = None, False
+    if request.method == "POST":
+        try:
+            credits = float(request.form["credits"])
+            price_per_credit = float(request.form["price_per_credit"])
+            ttl_days = float(request.form.get("ttl_days") or 0)
+        except ValueError:
+            credits = price_per_credit = ttl_days = math.nan
+
+        if not _positive(credits, price_per_credit):
+            msg = "Credits and price must be positive."
+        elif not 0 <= ttl_days <= MAX_LISTING_DAYS:
+            msg = f"The listing duration must be between 0 and {MAX_LISTING_DAYS} days."
+        else:
+            # Escrow credits with a conditional UPDATE so concurrent requests can't overdraw
+            expires_at = datetime.utcnow() + timedelta(days=ttl_days) if ttl_days else None
+            try:
+                settlement.create_listing(current_user.id, credits, price_per_credit, expires_at)
+            except settlement.InsufficientCredits:
+                msg = "You don’t have enough credits to list this amount."
+            else:
+                flash("Listing created successfully!", "success")
+                return redirect(url_for(".marketplace"))
+    return render_template("create_listing.html", message=msg, success=success)
+
+@bp.route("/cancel_listing/<int:listing_id>", methods=["POST"])
+@login_required
+def cancel_listing(listing_id):
+    try:
+        refunded = settlement.cancel_listing(current_user.id, listing_id)
+    except settlement.ListingUnavailable:
+        return marketplace(message="That listing is no longer available to cancel.")
+    return marketplace(message=f"Listing cancelled; {refunded:.2f} credits returned to your balance.")
+
+@bp.route("/buy/<int:listing_id>", methods=["POST"])
+@login_required
+def buy_credits(listing_id):
+    listing = MarketplaceListing.query.get_or_404(listing_id)
+
+    if listing.user_id == current_user.id:
+        flash("You cannot buy your own listing!", "warning")
+        return redirect(url_for(".marketplace"))
+    if listing.status != "available" or listing.expires_at and listing.expires_at <= datetime.utcnow():
+        flash(UNAVAILABLE.get(listing.status, UNAVAILABLE["expired"]), "danger")
+        return redirect(url_for(".marketplace"))
+
+    seller = User.query.get(listing.user_id)
+    if current_user.wallet_balance < listing.total_price:
+        flash("You don’t have enough balance in your wallet!", "danger")
+        return redirect(url_for(".marketplace"))
+
+    # The checks above are advisory; settlement re-checks both with compare-and-swap UPDATEs
+    try:
+        settlement.buy_listing(current_user.id, listing.id, seller.id, listing.credits, listing.price_per_credit)
+    except settlement.ListingUnavailable:
+        db.session.refresh(listing)
+        flash(UNAVAILABLE.get(listing.status, "This listing is no longer available."), "danger")
+        return redirect(url_for(".marketplace"))
+    except settlement.InsufficientFunds:
+        flash("You don’t have enough balance in your wallet!", "danger")
+        return redirect(url_for(".marketplace"))
+
+    return render_template("purchase_success.html", listing=listing, buyer=current_user, seller=seller)
+
+@bp.route("/buy_order", methods=["POST"])
+@login_required
+def buy_order():
+    try:
+        credits = float(request.form["credits"])
+        max_price = float(request.form["max_price"])
+    except (KeyError, ValueError):
+        return marketplace(message="Enter the number of credits and a maximum price.")
+    if not _positive(credits, max_price):
+        return marketplace(message="Credits and maximum price must be positive.")
+
+    # Fill across the cheapest asks first (price-time priority), splitting the last one if needed
+    try:
+        fills = order_book.buy(current_user, credits, max_price)
+    except settlement.InsufficientFunds:
+        return marketplace(message="You don’t have enough balance in your wallet!")
+    if not fills:
+        return marketplace(message=f"No listings available at or below ₹{max_price:.2f} that you can afford.")
+
+    filled = sum(f.credits for f in fills)
+    cost = sum(f.amount for f in fills)
+    message = (
+        f"Bought {filled:.2f} of {credits:.2f} credits from {len(fills)} listing(s) "
+        f"for ₹{cost:.2f} (avg ₹{cost / filled:.2f}/credit). "
+        f"Wallet balance: ₹{current_user.wallet_balance:.2f}."
+    )
+    return marketplace(message=message)
@@ -0,0 +1,46 @@
+from flask import Blueprint, render_template, request
+from flask_login import login_required, current_user
+from markupsafe import Markup
+
+from models import db, OffsetProgram
+import settlement
+from fragment_cache import fragment_cache, OFFSET_PROGRAMS_VERSION_KEY
+
+bp = Blueprint("offsets", __name__)
+
+# Offset Programs
+@bp.route('/offset', methods=['GET', 'POST'])
+@login_required
+def offset():
+    message = None
+    user = current_user
+    program_catalog = Markup(
+        fragment_cache.get_or_render("program_catalog", OFFSET_PROGRAMS_VERSION_KEY, render_program_catalog)
+    )
+
+    if request.method == 'POST':
+        program_id = request.form.get('program_id')
+        co2_amount = float(request.form.get('co2_amount'))
+        program = db.session.get(OffsetProgram, int(program_id))
+
+        credits_required = program.rate_per_kg * co2_amount
+        if co2_amount <= 0:
+            message = "Enter a positive amount of CO₂ to offset."
+        elif user.credits < credits_required:
+            message = f"Not enough credits! You need {credits_required:.2f} but have {user.credits:.2f}."
+        else:
+            try:
+                settlement.offset_credits(user.id, program.id, co2_amount, credits_required)
+            except settlement.InsufficientCredits:
+                message = f"Not enough credits! You need {credits_required:.2f} but have {user.credits:.2f}."
+                return render_template('offset.html', program_catalog=program_catalog, message=message, user=user)
+            message = (
+                f"Successfully offset {co2_amount:.2f} kg CO₂ via {program.name}. "
+                f"{credits_required:.2f} credits deducted. "
+                f"Remaining balance: {user.credits:.2f} credits."
+            )
+
+    return render_template('offset.html', program_catalog=program_catalog, message=message, user=user)
+
+def render_program_catalog():
+    return render_template('_program_catalog.html', programs=OffsetProgram.query.order_by(OffsetProgram.id).all())
@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from flask import Blueprint, render_template, request, abort
+from flask_login import login_required, current_user
+
+import analytics
+
+bp = Blueprint("reports", __name__)
+
+# Tenant-wide analytics: /analytics?start=2024-01-01&end=2024-12-31
+# Every member can see these, so they show tenant totals and never another member's name or figures
+def _date_args():
+    try:
+        return tuple(
+            datetime.strptime(request.args[arg], "%Y-%m-%d").date() if request.args.get(arg) else None
+            for arg in ("start", "end")
+        )
+    except ValueError:
+        abort(400, description="Dates must be YYYY-MM-DD.")
+
+@bp.route('/analytics')
+@login_required
+def analytics_report():
+    start, end = _date_args()
+    return render_template(
+        'analytics.html',
+        start=start, end=end,
+        leaders=analytics.top_emitters(5, start, end),
+        by_month=analytics.emissions_by_type_month(start, end),
+        prices=analytics.price_history(start, end),
+        programs=analytics.offsets_by_program(),
+    )
+
+# Ad-hoc group-by over the in-memory snapshot: /api/analytics?by=activity_type,month&metric=emission&top=20
+@bp.route('/api/analytics')
+@login_required
+def api_analytics():
+    start, end = _date_args()
+    by = [d for d in request.args.get('by', 'activity_type').split(',') if d]
+    types = request.args.getlist('type') or None
+    top = request.args.get('top', type=int)
+    # Per-user breakdowns only ever cover the caller; other dimensions are tenant totals
+    user_ids = [current_user.id] if 'user_id' in by else None
+    try:
+        items = analytics.snapshot.group_by(by, request.args.get('metric', 'emission'), user_ids=user_ids,
+                                            activity_types=types, start=start, end=end, top=top)
+    except ValueError as e:
+        abort(400, description=str(e))
+    return {"items": items}
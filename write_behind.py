@@ -0,0 +1,283 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from collections import deque
+from itertools import groupby
+
+from models import db, User, CacheVersion
+from cache_versions import get_version
+from db_helpers import is_retryable, upsert
+from ingest import ActivityBatch, parse_rows, compute_emissions, write_batch
+
+FLUSH_MS = 200          # longest a queued batch waits for others to coalesce with
+MAX_ROWS = 5000         # rows per writer transaction
+MAX_PENDING = 50000     # queued rows before submit() blocks (backpressure)
+PUT_TIMEOUT = 2.0       # seconds submit() blocks before raising WriteBehindFull
+RETRY_BACKOFF = 0.05    # seconds, doubled per failed flush up to MAX_BACKOFF
+MAX_BACKOFF = 2.0
+MAX_ATTEMPTS = 10       # tries per flush on transient errors (busy, deadlock, lost connection)
+STAMP_PREFIX = "write_behind:"  # CacheVersion row holding the last committed seq of a spill file
+
+
+class WriteBehindFull(Exception):
+    pass
+
+
+class WriteBehindQueue:
+    """Optional write-behind path for activity submissions.
+
+    Requests validate and price their rows, append them to this process's
+    spill file and return; a writer thread coalesces queued batches into
+    one transaction every FLUSH_MS or MAX_ROWS rows. Every spilled record
+    carries a sequence number, and each flush stores the last sequence it
+    committed under the spill file's CacheVersion stamp in the same
+    transaction, so recovery replays exactly the records that never
+    reached the database.
+
+    Spill files are spill-<pid>.ndjson in WRITE_BEHIND_SPILL_DIR, each held
+    under an exclusive flock by its process. On start, files whose owner
+    died are replayed and removed. Batches that cannot be committed (a
+    permanent error, or MAX_ATTEMPTS transient ones) are appended to
+    dead-<pid>.ndjson in the same directory, in spill record format, and
+    logged, so they never hold back the batches queued after them.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self._cond = threading.Condition()
+        self._items = deque()        # (seq, user_id, batch, enqueued_at)
+        self._pending_rows = 0
+        self._seq = 0
+        self._spill = None
+        self._stamp = None
+        self._thread = None
+        self._stopping = False
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get("WRITE_BEHIND", False)
+        self.flush_seconds = app.config.get("WRITE_BEHIND_FLUSH_MS", FLUSH_MS) / 1000
+        self.max_rows = app.config.get("WRITE_BEHIND_MAX_ROWS", MAX_ROWS)
+        self.max_pending = app.config.get("WRITE_BEHIND_MAX_PENDING", MAX_PENDING)
+        self.put_timeout = app.config.get("WRITE_BEHIND_PUT_TIMEOUT", PUT_TIMEOUT)
+        self.spill_dir = app.config.get("WRITE_BEHIND_SPILL_DIR") or os.path.join(app.instance_path, "write_behind")
+
+    # --- Producer side (request threads) ---
+    def submit(self, user_id, rows):
+        """Validate, price and queue row dicts. Returns (rows queued, total kg CO₂e).
+
+        Raises IngestError for bad rows and WriteBehindFull if the queue
+        stays full for PUT_TIMEOUT seconds.
+        """
+        batch = parse_rows(rows)
+        if batch is None:
+            return 0, 0.0
+        compute_emissions(batch)
+        self._start()
+        with self._cond:
+            deadline = time.monotonic() + self.put_timeout
+            while self._pending_rows and self._pending_rows + len(batch) > self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise WriteBehindFull(f"{self._pending_rows} rows queued")
+                self._cond.wait(remaining)
+            self._seq += 1
+            # Reaches the OS page cache, which survives a process crash; no fsync on the request path
+            self._spill.write(json.dumps({"seq": self._seq, "user_id": user_id, "rows": batch.rows()}) + "\n")
+            self._spill.flush()
+            self._items.append((self._seq, user_id, batch, time.monotonic()))
+            self._pending_rows += len(batch)
+            self._cond.notify_all()
+        return len(batch), float(batch.emissions.sum())
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far is committed. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._items or self._pending_rows:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    # --- Lifecycle ---
+    def _start(self):
+        # Started lazily so forked workers each get their own thread and spill file
+        with self._cond:
+            if self._thread is not None:
+                return
+            import fcntl  # POSIX only; imported here so the app loads where write-behind stays off
+
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with self.app.app_context():
+                recover(self.spill_dir)
+                path = os.path.join(self.spill_dir, f"spill-{os.getpid()}.ndjson")
+                self._spill = open(path, "a+", encoding="utf-8")
+                fcntl.flock(self._spill, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._stamp = STAMP_PREFIX + os.path.basename(path)
+                _set_stamp(self._stamp, 0)
+                db.session.commit()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout=10.0):
+        """Flush what is queued and stop the writer thread."""
+        with self._cond:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        thread.join(timeout)
+        if thread.is_alive():
+            return  # still retrying a flush; the spill file stays for recovery
+        with self._cond:
+            self._thread = None
+            self._close_spill(remove=not self._items)
+
+    def _close_spill(self, remove):
+        path = self._spill.name
+        self._spill.close()  # releases the flock
+        self._spill = None
+        if remove:
+            os.unlink(path)
+            with self.app.app_context():
+                CacheVersion.query.filter_by(name=self._stamp).delete()
+                db.session.commit()
+
+    # --- Writer thread ---
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._items and not self._stopping:
+                    self._cond.wait()
+                if not self._items:
+                    return
+                # Coalesce: wait for MAX_ROWS rows or until the oldest batch has waited FLUSH_MS
+                deadline = self._items[0][3] + self.flush_seconds
+                while self._pending_rows < self.max_rows and not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                taken, rows = [], 0
+                while self._items and (not taken or rows + len(self._items[0][2]) <= self.max_rows):
+                    item = self._items.popleft()
+                    taken.append(item)
+                    rows += len(item[2])
+            self._write(taken)
+            with self._cond:
+                self._pending_rows -= rows
+                if not self._items:
+                    # Everything spilled so far is committed
+                    self._spill.seek(0)
+                    self._spill.truncate()
+                self._cond.notify_all()
+
+    def _write(self, taken):
+        """Commit the taken batches; if that fails for good, commit them one by one and dead-letter the failures."""
+        if self._commit(taken):
+            return
+        for item in taken:
+            if len(taken) == 1 or not self._commit([item]):
+                self._dead_letter(item)
+
+    def _commit(self, taken):
+        """Write the batches and the spill stamp in one transaction, retrying transient errors. Returns success."""
+        records = [(user_id, batch) for _, user_id, batch, _ in taken]
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                with self.app.app_context():
+                    write_records(records)
+                    _set_stamp(self._stamp, taken[-1][0])
+                    db.session.commit()
+                return True
+            except Exception as e:
+                with self.app.app_context():
+                    db.session.rollback()
+                if not is_retryable(e):
+                    self.app.logger.exception("Write-behind flush of %d batches failed", len(taken))
+                    return False
+                self.app.logger.warning("Write-behind flush of %d batches failed (%s); retrying", len(taken), e)
+                time.sleep(min(RETRY_BACKOFF * 2 ** attempt, MAX_BACKOFF))
+        self.app.logger.error("Write-behind flush of %d batches gave up after %d attempts", len(taken), MAX_ATTEMPTS)
+        return False
+
+    def _dead_letter(self, item):
+        """Append a batch that cannot be written to the dead-letter file and move the stamp past it."""
+        seq, user_id, batch, _ = item
+        path = os.path.join(self.spill_dir, f"dead-{os.getpid()}.ndjson")
+        with open(path, "a", encoding="utf-8") as dead:
+            dead.write(json.dumps({"seq": seq, "user_id": user_id, "rows": batch.rows()}) + "\n")
+        self.app.logger.error("Write-behind batch %d (user %s, %d rows) moved to %s", seq, user_id, len(batch), path)
+        try:
+            with self.app.app_context():
+                _set_stamp(self._stamp, seq)
+                db.session.commit()
+        except Exception:
+            # Recovery would replay the batch once more; it is in the dead-letter file either way
+            self.app.logger.exception("Could not advance write-behind stamp past batch %d", seq)
+            with self.app.app_context():
+                db.session.rollback()
+
+
+def write_records(records):
+    """Write (user_id, batch) records with one write_batch per run of the same user. Caller commits."""
+    users = {u.id: u for u in User.query.filter(User.id.in_({user_id for user_id, _ in records}))}
+    for user_id, group in groupby(records, key=lambda r: r[0]):
+        if user_id in users:
+            write_batch(users[user_id], ActivityBatch.concat([batch for _, batch in group]))
+
+
+def _set_stamp(name, seq):
+    upsert(CacheVersion, [{"name": name, "version": seq}], index_elements=["name"],
+           update={"version": lambda ex: ex.version})
+
+
+# --- Crash recovery ---
+def recover(spill_dir):
+    """Replay and remove spill files whose process is gone. Returns the number of rows replayed."""
+    import fcntl
+
+    replayed = 0
+    for path in sorted(glob.glob(os.path.join(spill_dir, "spill-*.ndjson"))):
+        with open(path, "r", encoding="utf-8") as spill:
+            try:
+                fcntl.flock(spill, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # owned by a live worker
+            stamp = STAMP_PREFIX + os.path.basename(path)
+            committed = get_version(stamp)
+            records, last_seq = [], committed
+            for line in spill:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # torn final line from the crash
+                if record["seq"] > committed:
+                    batch = parse_rows(record["rows"])
+                    if batch is not None:
+                        compute_emissions(batch)
+                        records.append((record["user_id"], batch))
+                    last_seq = max(last_seq, record["seq"])
+            if records:
+                write_records(records)
+                _set_stamp(stamp, last_seq)
+                db.session.commit()
+                replayed += sum(len(batch) for _, batch in records)
+            # Unlink before dropping the stamp: a crash in between must not replay the file again
+            os.unlink(path)
+        CacheVersion.query.filter_by(name=stamp).delete()
+        db.session.commit()
+    return replayed
+
+
+write_behind = WriteBehindQueue()